@@ -3,14 +3,34 @@ from tkinter import ttk, filedialog, messagebox
 import os
 import csv
 import sys
+import json
+import contextlib
 import re
 import threading
+import hashlib
+import pickle
+import gzip
+import shutil
+import sqlite3
+import tempfile
+import itertools
+from array import array
+import time
+import signal
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
 from datetime import datetime
 
 # --- CONFIGURAÇÃO DE OTIMIZAÇÃO (GLOBAL) ---
 pd = None
 
 # --- CONFIGURAÇÕES VISUAIS ---
+ALTURA_LINHA_PREVIEW = 30  # Mesmo rowheight do estilo da Treeview
+BUFFER_PREVIEW = 20  # Linhas extras materializadas abaixo da área visível
 COLORS = {
     "primary": "#2C3E50", "secondary": "#ECF0F1", "card_bg": "#FFFFFF",
     "text_dark": "#2C3E50", "text_light": "#FFFFFF", "accent_blue": "#3498DB",
@@ -25,9 +45,2061 @@ else:
 
 ICON_PATH = os.path.join(BASE_DIR, "doc.ico")
 CONFIG_FILE = os.path.join(os.path.expanduser("~"), "logistica_seq_config.txt")
+BASE_ENTREGAS = os.path.join(os.path.expanduser("~"), "logistica_entregas.db")
+
+
+def carregar_pandas():
+    global pd
+    if pd is None:
+        import pandas as pandas_lib
+        pd = pandas_lib
+    return pd
+
+
+# --- EXPORTAÇÃO ---
+# Formatos de saída: o CSV padrão (';', tudo entre aspas, BOM utf-8) e, para carga em outros sistemas,
+# o mesmo CSV compactado em gzip ou Parquet (precisa do pyarrow).
+FORMATOS_SAIDA = {"csv": ".csv", "csv.gz": ".csv.gz", "parquet": ".parquet"}
+TAMANHO_BLOCO_EXPORTACAO = 100000
+
+
+def gerar_nome_saida(file_path, formato="csv"):
+    agora = datetime.now().strftime("%d-%m-%Y_%Hh%M")
+    extensao = FORMATOS_SAIDA[formato]
+    if file_path:
+        nome_original = os.path.splitext(os.path.basename(file_path))[0]
+        nome_limpo = re.sub(r'[^\w\-]', '_', nome_original)
+        if len(nome_limpo) > 40: nome_limpo = nome_limpo[:40]
+        return f"Logistica_{nome_limpo}_{agora}{extensao}"
+    return f"Logistica_Geral_{agora}{extensao}"
+
+
+def fatiar(df, tamanho=TAMANHO_BLOCO_EXPORTACAO):
+    """Fatias (views, sem cópia) de um DataFrame já montado, para exportar em blocos."""
+    for inicio in range(0, len(df), tamanho):
+        yield df.iloc[inicio:inicio + tamanho]
+
+
+def colunas_exportacao(df, com_item=False):
+    """Listas de valores por coluna (sem ITEM), como o to_csv as escreveria: NF como str e vazios como "".
+    Colunas compactas (ver compactar_resultado) voltam ao texto aqui, só para as linhas pedidas."""
+    if isinstance(df, TabelaLeve): return df.colunas_texto(com_item)
+    colunas = []
+    for nome in df.columns:
+        if nome == "ITEM" and not com_item: continue
+        serie = df[nome]
+        if serie.dtype.kind == "M":
+            colunas.append(texto_datas(serie))
+        elif nome == "Nr. Doc." and serie.dtype.kind == "u":
+            colunas.append(texto_nf(serie.to_numpy()))
+        elif nome == "Nr. Doc.":
+            colunas.append(serie.astype(str).tolist())
+        else:
+            colunas.append((serie.where(serie.notna(), "") if serie.hasnans else serie).tolist())
+    return colunas
+
+
+def exportar_blocos(blocos, caminho, formato="csv"):
+    """Grava cada bloco assim que é produzido, direto das colunas (sem copiar o DataFrame). Devolve o total de linhas."""
+    if formato == "parquet":
+        return exportar_parquet(blocos, caminho)
+    total = 0
+    abrir = gzip.open if formato == "csv.gz" else open
+    with abrir(caminho, 'wt', encoding='utf-8-sig', newline='') as f:
+        escritor = csv.writer(f, delimiter=';', quoting=csv.QUOTE_ALL, lineterminator=os.linesep)
+        for df in blocos:
+            escritor.writerows(zip(*colunas_exportacao(df)))
+            total += len(df)
+    return total
+
+
+def exportar_parquet(blocos, caminho):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("A exportação em Parquet precisa do pacote 'pyarrow' (pip install pyarrow).")
+    total = 0
+    escritor = None
+    try:
+        for df in blocos:
+            nomes = [c for c in df.columns if c != "ITEM"]
+            tabela = pa.Table.from_arrays([pa.array(col, type=pa.string()) for col in colunas_exportacao(df)],
+                                          names=nomes)
+            if escritor is None: escritor = pq.ParquetWriter(caminho, tabela.schema)
+            escritor.write_table(tabela)
+            total += len(df)
+        if escritor is None:
+            pq.write_table(pa.table({c: pa.array([], type=pa.string()) for c in COLUNAS_SAIDA}), caminho)
+    finally:
+        if escritor is not None: escritor.close()
+    return total
+
+
+def exportar_csv(df, caminho, formato="csv"):
+    return exportar_blocos(fatiar(df), caminho, formato)
+
+
+# --- BASE LOCAL DE ENTREGAS (SQLITE) ---
+# Opcional: acumula as linhas limpas de todas as transportadoras num único arquivo indexado por
+# (Nr. Doc., transportadora), para consultar a última entrega de uma NF sem abrir os CSVs exportados.
+# Vazios não apagam o que já foi gravado (um relatório sem a data de entrega não desfaz a baixa anterior)
+SQL_UPSERT_ENTREGA = """
+    INSERT INTO entregas (nr_doc, transportadora, previsao, entrega, entrega_iso, arquivo, atualizado)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (nr_doc, transportadora) DO UPDATE SET
+        previsao = COALESCE(NULLIF(excluded.previsao, ''), entregas.previsao),
+        entrega = COALESCE(NULLIF(excluded.entrega, ''), entregas.entrega),
+        entrega_iso = COALESCE(NULLIF(excluded.entrega_iso, ''), entregas.entrega_iso),
+        arquivo = excluded.arquivo, atualizado = excluded.atualizado
+"""
+
+
+class BaseEntregas:
+    def __init__(self, caminho=BASE_ENTREGAS):
+        self.caminho = caminho
+        self.conexao = sqlite3.connect(caminho, timeout=30)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.execute("""CREATE TABLE IF NOT EXISTS entregas (
+            nr_doc TEXT NOT NULL, transportadora TEXT NOT NULL,
+            previsao TEXT, entrega TEXT, entrega_iso TEXT, arquivo TEXT, atualizado TEXT,
+            PRIMARY KEY (nr_doc, transportadora)) WITHOUT ROWID""")
+        self.conexao.execute("CREATE INDEX IF NOT EXISTS idx_entregas_transportadora ON entregas (transportadora)")
+        self.conexao.commit()
+
+    def gravando(self, blocos, transportadora, arquivo=None):
+        """Repassa os blocos adiante (ex.: para a exportação), gravando cada um na sua própria transação: a trava de
+        escrita do SQLite não fica presa enquanto o próximo bloco é lido (os outros processos do lote esperariam)."""
+        agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        arquivo = os.path.basename(arquivo) if arquivo else ""
+        for df in blocos:
+            nf, prev, ent = colunas_exportacao(df[COLUNAS_SAIDA])
+            iso = [f"{d[6:10]}-{d[3:5]}-{d[0:2]}" if d else "" for d in ent]
+            n = len(nf)
+            with self.conexao:
+                self.conexao.executemany(SQL_UPSERT_ENTREGA, zip(nf, [transportadora] * n, prev, ent, iso,
+                                                                 [arquivo] * n, [agora] * n))
+            yield df
+
+    def gravar(self, blocos, transportadora, arquivo=None):
+        """Upsert de um DataFrame (ou de vários blocos). Devolve o total de linhas gravadas."""
+        if hasattr(blocos, "columns"): blocos = [blocos]
+        return sum(len(df) for df in self.gravando(blocos, transportadora, arquivo))
+
+    def consultar(self, nr_doc, transportadora=None):
+        """Registros da NF (aceita o número sem zeros à esquerda), da entrega mais recente para a mais antiga."""
+        nr_doc = str(nr_doc).strip()
+        chaves = {nr_doc, nr_doc.zfill(6)[-6:]} if nr_doc.isdigit() else {nr_doc}
+        sql = f"SELECT * FROM entregas WHERE nr_doc IN ({','.join('?' * len(chaves))})"
+        parametros = list(chaves)
+        if transportadora:
+            sql += " AND transportadora = ?"
+            parametros.append(transportadora)
+        cursor = self.conexao.execute(sql + " ORDER BY entrega_iso DESC, atualizado DESC", parametros)
+        nomes = [c[0] for c in cursor.description]
+        return [dict(zip(nomes, linha)) for linha in cursor]
+
+    def ultima_entrega(self, nr_doc):
+        """Registro com a data de entrega mais recente da NF em qualquer transportadora (None se não houver)."""
+        return next((r for r in self.consultar(nr_doc) if r["entrega"]), None)
+
+    def fechar(self):
+        self.conexao.close()
+
+
+# --- CONTADOR SEQUENCIAL ---
+# Um número por exportação salva, compartilhado por todas as instâncias (GUI, lote, vigia). Toda leitura e
+# escrita acontece sob trava de arquivo do SO e a gravação é atômica (temporário + rename): duas instâncias
+# nunca recebem o mesmo número nem deixam o arquivo truncado.
+@contextlib.contextmanager
+def travar_arquivo(caminho):
+    """Trava exclusiva entre processos em `caminho`.lock; espera enquanto outro processo a segura."""
+    with open(caminho + ".lock", "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK desiste depois de ~10 tentativas: continua esperando
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def gravar_atomico(caminho, texto):
+    temporario = f"{caminho}.{os.getpid()}.tmp"
+    with open(temporario, "w") as f:
+        f.write(texto)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+
+
+class ContadorSequencial:
+    def __init__(self, caminho=CONFIG_FILE):
+        self.caminho = caminho
+
+    def _ler(self):
+        try:
+            with open(self.caminho, "r") as f: return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def atual(self):
+        """Último número entregue (0 se o arquivo não existe ou está ilegível)."""
+        with travar_arquivo(self.caminho):
+            return self._ler()
+
+    def reservar(self, quantidade=1):
+        """Reserva `quantidade` números seguidos sob uma única trava e devolve o primeiro."""
+        with travar_arquivo(self.caminho):
+            primeiro = self._ler() + 1
+            gravar_atomico(self.caminho, str(primeiro + quantidade - 1))
+        return primeiro
+
+    def definir(self, numero):
+        with travar_arquivo(self.caminho):
+            gravar_atomico(self.caminho, str(numero))
+
+
+# --- EXPORTAÇÃO INCREMENTAL (DELTA) ---
+# As transportadoras reenviam relatórios acumulados: o arquivo de hoje repete quase tudo o de ontem. No modo
+# delta só são exportadas as linhas novas ou alteradas. Para cada transportadora fica guardado o hash de 64 bits
+# de cada linha já exportada (Nr. Doc. + previsão + entrega, 8 bytes por linha) num array ordenado: uma NF que
+# mudou de data gera outra linha e volta a sair. "completo" exporta tudo (e registra as linhas no índice). O
+# índice só é regravado depois que a exportação deu certo, sob trava de arquivo. No lote, a trava vale da leitura
+# do índice até a regravação: arquivos da mesma transportadora são filtrados um depois do outro (em paralelo, os
+# dois veriam o índice antigo e exportariam tudo); as outras transportadoras seguem em paralelo.
+PASTA_DELTA = os.path.join(os.path.expanduser("~"), ".logistica_delta")
+MODOS_DELTA = ("novas", "completo")
+
+
+def hashes_delta(df):
+    """Hash de cada linha (Nr. Doc., previsão, entrega), calculado sobre o texto exportado."""
+    nf, prev, ent = colunas_exportacao(df[COLUNAS_SAIDA])
+    linhas = pd.DataFrame({"n": list(nf), "p": list(prev), "e": list(ent)})
+    return pd.util.hash_pandas_object(linhas, index=False).to_numpy()
+
+
+def filtrar_linhas(df, mascara):
+    if isinstance(df, TabelaLeve):
+        return TabelaLeve({nome: [v for v, manter in zip(valores, mascara) if manter]
+                           for nome, valores in df.colunas.items()})
+    return df[mascara]
+
+
+class IndiceDelta:
+    def __init__(self, transportadora, pasta=PASTA_DELTA):
+        carregar_pandas()  # hashes vetorizados
+        self.caminho = os.path.join(pasta, f"{transportadora}.npy")
+        self.hashes = self._ler()
+        self.marcadas = 0  # linhas avaliadas (antes do filtro)
+        self._pendentes = []
+        self._travado = False
+
+    def _ler(self):
+        import numpy as np
+        try:
+            return np.load(self.caminho)
+        except (OSError, ValueError):
+            return np.empty(0, dtype=np.uint64)
+
+    def marcar(self, df, completo=False):
+        """Máscara das linhas ainda não exportadas (todas, com completo). As linhas ficam pendentes até gravar()."""
+        import numpy as np
+        hashes = hashes_delta(df)
+        self._pendentes.append(hashes)
+        self.marcadas += len(hashes)
+        if completo or not len(self.hashes): return np.ones(len(hashes), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return self.hashes[pos] != hashes
+
+    def filtrando(self, blocos, completo=False):
+        for df in blocos:
+            mascara = self.marcar(df, completo)
+            yield df if mascara.all() else filtrar_linhas(df, mascara)
+
+    @contextlib.contextmanager
+    def exclusivo(self):
+        """Segura o índice da transportadora (relido sob a trava) até o fim do bloco: filtre, exporte e grave dentro
+        dele. Outro processo com a mesma transportadora espera."""
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with travar_arquivo(self.caminho):
+            self.hashes = self._ler()
+            self._travado = True
+            try:
+                yield self
+            finally:
+                self._travado = False
+
+    def gravar(self):
+        """Junta as linhas pendentes ao índice em disco e o regrava."""
+        import numpy as np
+        if not sum(len(hashes) for hashes in self._pendentes): return
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        with contextlib.nullcontext() if self._travado else travar_arquivo(self.caminho):
+            # fora de exclusivo(), relê: outro processo pode ter exportado desde a nossa leitura
+            atual = self.hashes if self._travado else self._ler()
+            self.hashes = np.unique(np.concatenate([atual] + self._pendentes))
+            temporario = f"{self.caminho}.{os.getpid()}.tmp"
+            with open(temporario, "wb") as f:
+                np.save(f, self.hashes)
+            os.replace(temporario, self.caminho)
+        self._pendentes = []
+
+
+def filtrar_delta(df, transportadora, completo=False):
+    """Delta de um resultado já montado (pré-visualização da GUI); o consolidado (coluna Transportadora) usa o
+    índice de cada transportadora. Devolve (linhas a exportar, índices a gravar depois da exportação)."""
+    import numpy as np
+    carregar_pandas()
+    if "Transportadora" not in df.columns:
+        indice = IndiceDelta(transportadora)
+        return filtrar_linhas(df, indice.marcar(df, completo)), [indice]
+    indices = []
+    mascara = np.ones(len(df), dtype=bool)
+    for layout, posicoes in df.groupby("Transportadora", observed=True, sort=False).indices.items():
+        indice = IndiceDelta(layout)
+        mascara[posicoes] = indice.marcar(df.iloc[posicoes], completo)
+        indices.append(indice)
+    return filtrar_linhas(df, mascara), indices
+
+
+# --- DETECÇÃO DE LAYOUT POR ASSINATURA ---
+# Cada layout lista alternativas; uma alternativa casa quando todos os seus termos aparecem.
+# A ordem da tabela é a prioridade (a mesma da antiga cadeia de testes).
+TERMOS_NF = ("N.FISCAL", "NFISCAL", "NOTAFISCAL", "NR_NFE")
+ASSINATURAS_NOME = (
+    ("LISTA_CARGAS", [("LISTA", "CARGAS")]),
+    ("TXT_EXCELLENCE", [("EXCELLENCE",)]),
+    ("LT", [("LT",), ("DONIZETE",)]),
+    ("AGE", [("AGE",), ("MH",)]),
+    ("ALFA", [("ALFA",)]),
+    ("TNT", [("TNT",)]),
+)
+ASSINATURAS_CONTEUDO = (
+    ("TXT_EXCELLENCE", [("EXCELLENCE", "NFISCAL")]),
+    ("ALFA", [("NRO.DOC",)]),
+    ("TNT", [("NOTA", "SERIE"), ("NOTA", "SÉRIE"), ("FIL. ORIGEM",)]),
+    ("LT", [("DON", nf) for nf in TERMOS_NF]),
+    ("AGE", [("CTRC", nf) for nf in TERMOS_NF] + [("PREV", "ENTR", nf) for nf in TERMOS_NF]),
+)
+LIMITE_CACHE_LAYOUT = 256
+CACHE_LAYOUT = OrderedDict()  # (tamanho, mtime, hash do início) -> layout detectado pelo conteúdo
+
+
+def compilar_assinaturas(assinaturas):
+    """Gera um único regex com todos os termos (lookahead: acha termos sobrepostos numa só passada)."""
+    termos = sorted({t for _, alternativas in assinaturas for alt in alternativas for t in alt}, key=len, reverse=True)
+    regex = re.compile("(?=(" + "|".join(re.escape(t) for t in termos) + "))")
+    # Um termo encontrado implica os termos contidos nele (ex: NOTAFISCAL -> NOTA), que o regex não repete
+    implicacoes = {t: {o for o in termos if o in t} for t in termos}
+    return regex, implicacoes
+
+
+RE_TOKENS_NOME = compilar_assinaturas(ASSINATURAS_NOME)
+RE_TOKENS_CONTEUDO = compilar_assinaturas(ASSINATURAS_CONTEUDO)
+
+
+def casar_assinaturas(texto, assinaturas, compilado):
+    regex, implicacoes = compilado
+    encontrados = set()
+    for termo in set(regex.findall(texto)):
+        encontrados |= implicacoes[termo]
+    for layout, alternativas in assinaturas:
+        if any(encontrados.issuperset(alt) for alt in alternativas):
+            return layout
+    return None
+
+
+def chave_cache_layout(path, tamanho_amostra=64 * 1024):
+    info = os.stat(path)
+    with open(path, 'rb') as f:
+        resumo = hashlib.sha1(f.read(tamanho_amostra)).hexdigest()
+    return info.st_size, info.st_mtime_ns, resumo
+
+
+def ler_amostra_xlsx(path, linhas=20, abas=3):
+    """Lê só as primeiras linhas das primeiras abas em modo streaming (openpyxl read-only), sem pandas."""
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        partes = []
+        for ws in wb.worksheets[:abas]:
+            for row in ws.iter_rows(max_row=linhas, values_only=True):
+                partes.append(" ".join("" if v is None else str(v) for v in row))
+        return "\n".join(partes).upper()
+    finally:
+        wb.close()
+
+
+# --- NORMALIZAÇÃO VETORIZADA DE NF ---
+RE_NAO_DIGITO = re.compile(r'\D')
+RE_DECIMAL_FINAL = re.compile(r'\.0$')
+
+
+def normalizar_nf(serie, cortar_serie=False, truncar=True, manter_texto=False, so_digitos=True):
+    """Normaliza a coluna de NF com operações .str (substitui os antigos clean_* aplicados linha a linha).
+
+    cortar_serie: descarta o sufixo '-serie' (TNT).
+    truncar: mantém só os 6 últimos dígitos.
+    manter_texto: sem dígitos, devolve o texto original em vez de "".
+    so_digitos=False: não remove caracteres, só completa com zeros valores já numéricos (ALFA).
+    """
+    s = serie.astype(str).str.strip()
+    if not so_digitos:
+        s = s.str.replace(RE_DECIMAL_FINAL, '', regex=True)
+        return s.where(~s.str.isdigit().astype(bool), s.str.zfill(6))
+
+    vazio = s.isna() | (s == '') | (s.str.lower() == 'nan')
+    s = s.str.replace(RE_DECIMAL_FINAL, '', regex=True)
+    if cortar_serie:
+        s = s.str.split('-', n=1).str[0].str.strip()
+    numeros = s.str.replace(RE_NAO_DIGITO, '', regex=True)
+    formatado = numeros.str.zfill(6)
+    if truncar:
+        formatado = formatado.str[-6:]
+    resultado = formatado.where(numeros != '', s if manter_texto else '')
+    return resultado.mask(vazio, '')
+
+
+# --- MOTOR DE DATAS (UM PARSE POR VALOR DISTINTO) ---
+FORMATO_SAIDA_DATA = "%d/%m/%Y 00:00"
+
+# Formatos vetorizáveis: (formato, padrão exato que a chave precisa casar).
+# Estrito = antigo fmt_dt (strptime); flexível = antigo local_fmt_dt (pd.to_datetime com dayfirst).
+FORMATOS_DATA_ESTRITO = (
+    ("%d/%m/%Y", re.compile(r"\d{2}/\d{2}/\d{4}")),
+    ("%Y-%m-%d", re.compile(r"\d{4}-\d{2}-\d{2}")),
+    ("%d-%m-%Y", re.compile(r"\d{2}-\d{2}-\d{4}")),
+    ("%Y/%m/%d", re.compile(r"\d{4}/\d{2}/\d{2}")),
+)
+FORMATOS_DATA_FLEXIVEL = (
+    ("%d/%m/%Y", re.compile(r"\d{2}/\d{2}/\d{4}")),
+    ("%d/%m/%y", re.compile(r"\d{2}/\d{2}/\d{2}")),
+)
+
+
+def formatar_data_escalar(val):
+    if pd.isna(val) or str(val).strip() == '': return ""
+    try:
+        # Tenta múltiplos formatos comuns em sistemas brasileiros
+        s = str(val).strip()
+        # Remove horas se estiver no formato Excel 'YYYY-MM-DD HH:MM:SS'
+        if " " in s: s = s.split(" ")[0]
+
+        for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%Y/%m/%d"):
+            try:
+                dt = datetime.strptime(s, fmt)
+                return dt.strftime(FORMATO_SAIDA_DATA)
+            except:
+                continue
+        return ""
+    except:
+        return ""
+
+
+def formatar_data_flexivel_escalar(val):
+    if pd.isna(val) or str(val).strip() == '': return ""
+    try:
+        # O pandas é mais inteligente para detectar formatos variados
+        dt = pd.to_datetime(val, dayfirst=True, errors='coerce')
+        if pd.notna(dt):
+            return dt.strftime(FORMATO_SAIDA_DATA)
+        return ""
+    except:
+        return ""
+
+
+def _expandir_ano_2_digitos(chave, ano_ref):
+    # Mesma janela de 50 anos que o dateutil usa no pd.to_datetime escalar (ex: 25 -> 2025, 80 -> 1980)
+    ano = ano_ref // 100 * 100 + int(chave[-2:])
+    if ano >= ano_ref + 50:
+        ano -= 100
+    elif ano < ano_ref - 50:
+        ano += 100
+    return f"{chave[:-2]}{ano}"
+
+
+def formatar_datas(serie, flexivel=False):
+    """Formata uma coluna de datas como '%d/%m/%Y 00:00' parseando cada valor distinto uma única vez.
+
+    O formato é inferido uma vez por coluna e aplicado num único pd.to_datetime(format=...);
+    o que não casar cai no parser escalar antigo, preservando o resultado byte a byte.
+    """
+    escalar = formatar_data_flexivel_escalar if flexivel else formatar_data_escalar
+    codigos, unicos = pd.factorize(serie)
+    valores = [None] * len(unicos)
+
+    if isinstance(unicos, pd.DatetimeIndex):
+        valores = list(unicos.strftime(FORMATO_SAIDA_DATA))
+    else:
+        if flexivel:
+            chaves = [u.strip() if isinstance(u, str) else None for u in unicos]
+            formatos = FORMATOS_DATA_FLEXIVEL
+        else:
+            chaves = [str(u).strip().split(" ")[0] for u in unicos]
+            formatos = FORMATOS_DATA_ESTRITO
+
+        formato = next((f for c in chaves if c for f in formatos if f[1].fullmatch(c)), None)
+        if formato:
+            fmt, padrao = formato
+            posicoes = [i for i, c in enumerate(chaves) if c and padrao.fullmatch(c)]
+            textos = [chaves[i] for i in posicoes]
+            if fmt == "%d/%m/%y":
+                ano_ref = datetime.now().year
+                textos = [_expandir_ano_2_digitos(t, ano_ref) for t in textos]
+                fmt = "%d/%m/%Y"
+            datas = pd.to_datetime(pd.Series(textos, dtype=object), format=fmt, errors='coerce')
+            for i, texto in zip(posicoes, datas.dt.strftime(FORMATO_SAIDA_DATA)):
+                if isinstance(texto, str): valores[i] = texto
+
+        for i, u in enumerate(unicos):
+            if valores[i] is None: valores[i] = escalar(u)
+
+    tabela = pd.Series(valores + [""], dtype=object).to_numpy()
+    return pd.Series(tabela[codigos], index=serie.index, dtype=object)
+
+
+# --- RESULTADO COMPACTO ---
+# O resultado que fica na sessão (pré-visualização, cache) guarda a NF de 6 dígitos como inteiro e as datas
+# como datetime64 (NaT = vazio) em vez de um str por célula; o texto do CSV só é montado na exportação e nas
+# linhas visíveis da pré-visualização. NF fora desse padrão (TNT/ALFA com série ou texto) continua como texto.
+LARGURA_NF = 6
+
+
+def nf_fixa(valores):
+    """True se todas as NF são texto com exatamente LARGURA_NF dígitos (voltam iguais de um inteiro)."""
+    try:
+        junto = "".join(valores)
+    except TypeError:
+        return False
+    return set(map(len, valores)) == {LARGURA_NF} and junto.isascii() and junto.isdigit()
+
+
+def compactar_nf(valores):
+    import numpy as np
+    if not nf_fixa(valores): return None
+    digitos = np.frombuffer("".join(valores).encode("ascii"), dtype=np.uint8).reshape(-1, LARGURA_NF) - 48
+    return digitos @ (10 ** np.arange(LARGURA_NF - 1, -1, -1)).astype(np.uint32)
+
+
+def texto_nf(numeros):
+    import numpy as np
+    digitos = numeros[:, None] // (10 ** np.arange(LARGURA_NF - 1, -1, -1)).astype(np.uint32) % 10 + 48
+    return digitos.astype(np.uint8).view(f"S{LARGURA_NF}").ravel().astype(f"U{LARGURA_NF}").tolist()
+
+
+def data_saida(texto):
+    """datetime de um 'dd/mm/aaaa 00:00' (None para ""); ValueError se o texto não voltaria idêntico."""
+    if texto == "": return None
+    data = datetime.strptime(texto, FORMATO_SAIDA_DATA)
+    if data.strftime(FORMATO_SAIDA_DATA) != texto: raise ValueError(texto)
+    return data
+
+
+def compactar_datas(serie):
+    import numpy as np
+    codigos, unicos = pd.factorize(serie)
+    try:
+        datas = [data_saida(u) for u in unicos]
+    except (TypeError, ValueError):
+        return None
+    tabela = np.array([np.datetime64(d, 's') if d else np.datetime64('NaT') for d in datas] + [np.datetime64('NaT')],
+                      dtype='datetime64[s]')
+    return pd.Series(tabela[codigos], index=serie.index)
+
+
+def texto_datas(serie):
+    import numpy as np
+    codigos, unicos = pd.factorize(serie)
+    return np.array(list(unicos.strftime(FORMATO_SAIDA_DATA)) + [""], dtype=object)[codigos].tolist()
+
+
+def ordinais_datas(valores):
+    memo = {"": 0}
+    try:
+        for v in valores:
+            if v not in memo: memo[v] = data_saida(v).toordinal()
+    except (TypeError, ValueError):
+        return None
+    return array('l', [memo[v] for v in valores])
+
+
+def texto_ordinais(ordinais):
+    memo = {0: ""}
+    for o in set(ordinais):
+        if o not in memo: memo[o] = datetime.fromordinal(o).strftime(FORMATO_SAIDA_DATA)
+    return [memo[o] for o in ordinais]
+
+
+def compactar_resultado(df):
+    """Converte no lugar as colunas de saída para a forma compacta (o que não couber fica como está) e devolve df."""
+    if isinstance(df, TabelaLeve): return df.compactar()
+    for nome in COLUNAS_SAIDA:
+        if nome not in df.columns or df[nome].dtype != object: continue
+        compacto = compactar_nf(df[nome].tolist()) if nome == "Nr. Doc." else compactar_datas(df[nome])
+        if compacto is not None: df[nome] = compacto
+    return df
+
+
+# --- SESSÃO DE PLANILHA (UM PARSE POR ARQUIVO) ---
+class SessaoPlanilha:
+    """Abre o xls/xlsx uma única vez e guarda as abas já lidas para a detecção e a limpeza.
+
+    Cada aba é lida uma vez em forma bruta (header=None, sem conversão de tipos); as leituras
+    com header/skiprows/nrows são derivadas dela pelo mesmo TextParser que o pd.read_excel usa.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._xls = None
+        self._erro_xls = None
+        self._linhas = {}
+
+    @property
+    def xls(self):
+        if self._xls is None:
+            if self._erro_xls is not None: raise self._erro_xls
+            try:
+                self._xls = pd.ExcelFile(self.path)
+            except Exception as e:
+                self._erro_xls = e
+                raise
+        return self._xls
+
+    @property
+    def sheet_names(self):
+        return self.xls.sheet_names
+
+    def _linhas_aba(self, sheet_name):
+        if isinstance(sheet_name, int): sheet_name = self.sheet_names[sheet_name]
+        if sheet_name not in self._linhas:
+            bruto = pd.read_excel(self.xls, sheet_name=sheet_name, header=None, dtype=object)
+            self._linhas[sheet_name] = bruto.where(bruto.notna(), "").to_numpy().tolist()
+        return self._linhas[sheet_name]
+
+    def localizar_linha(self, teste, sheet_name=0, limite=None):
+        """Posição da 1ª linha bruta (já em cache) que satisfaz teste(valores); None se não houver."""
+        for pos, valores in enumerate(self._linhas_aba(sheet_name)[:limite]):
+            if teste(valores):
+                return pos
+        return None
+
+    def linha(self, pos, sheet_name=0):
+        """Valores brutos da linha `pos` (None se a aba for mais curta)."""
+        linhas = self._linhas_aba(sheet_name)
+        return linhas[pos] if pos < len(linhas) else None
+
+    def ler(self, sheet_name=0, header=0, skiprows=None, nrows=None, usecols=None):
+        from pandas.io.parsers import TextParser
+        linhas = self._linhas_aba(sheet_name)
+        if not linhas: return pd.DataFrame()
+        try:
+            parser = TextParser(linhas, header=header, skiprows=skiprows, nrows=nrows, usecols=usecols,
+                                skip_blank_lines=False)
+            return parser.read(nrows=nrows)
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+
+    def fechar(self):
+        if self._xls is not None: self._xls.close()
+        self._xls = None
+        self._linhas = {}
+
+
+# --- LEITURA DE CSV EM BLOCOS ---
+COLUNAS_SAIDA = ["Nr. Doc.", "Data de Previsão de Entrega", "Data Entrega"]
+PALAVRAS_CABECALHO_NF = ["N.FISCAL", "NFISCAL", "NOTA FISCAL", "NR.NOTA", "N. NOTA", "NR_NFE"]
+TAMANHO_AMOSTRA_CSV = 64 * 1024
+TAMANHO_BLOCO_CSV = 100000
+ASSINATURAS_PLANILHA = (b'PK\x03\x04', b'\xd0\xcf\x11\xe0')
+ENGINES_PLANILHA = {b'PK\x03\x04': "openpyxl", b'\xd0\xcf\x11\xe0': "xlrd"}  # xlsx (zip) / xls (OLE)
+
+
+def eh_planilha(path):
+    """Identifica xlsx (zip) / xls (OLE) pelos bytes iniciais, sem depender da extensão."""
+    with open(path, 'rb') as f:
+        return f.read(8).startswith(ASSINATURAS_PLANILHA)
+
+
+class AmostraCSV:
+    """Lê só o início do arquivo para farejar o separador (uma única vez) e localizar o cabeçalho.
+
+    A leitura completa vai direto para o engine C do pandas, em blocos de TAMANHO_BLOCO_CSV linhas,
+    em vez do read_csv(sep=None, engine='python') que carregava o arquivo inteiro.
+    """
+
+    def __init__(self, path, encoding='latin1', tamanho=TAMANHO_AMOSTRA_CSV):
+        self.path = path
+        self.encoding = encoding
+        with open(path, 'rb') as f:
+            bruto = f.read(tamanho)
+        if bruto.startswith(ASSINATURAS_PLANILHA):
+            raise ValueError("O arquivo é uma planilha, não um texto delimitado.")
+        if len(bruto) == tamanho and b'\n' in bruto:
+            bruto = bruto[:bruto.rindex(b'\n') + 1]  # Descarta a última linha, que pode estar cortada
+        texto = bruto.decode(encoding)
+        if texto.startswith('\ufeff'): texto = texto[1:]
+        self.linhas_texto = [linha.rstrip('\r') for linha in texto.split('\n')]
+        # Byte onde começa cada linha física: a leitura completa continua dali, sem reprocessar o início
+        self.deslocamentos = [0] + [m.end() for m in re.finditer(b'\n', bruto)]
+        self.farejar()
+
+    def farejar(self, skiprows=None):
+        """Separador e campos como o read_csv(sep=None, skiprows=...) os veria: fareja pela primeira linha não
+        vazia a partir de `skiprows`; se não der, pela amostra dali em diante. Um título acima do cabeçalho
+        (ex.: TNT) tem outro separador aparente: quem lê a partir do cabeçalho fareja de novo nele."""
+        linhas_texto = self.linhas_texto[skiprows or 0:]
+        primeira = next((linha for linha in linhas_texto if linha), "")
+        try:
+            self.separador = csv.Sniffer().sniff(primeira).delimiter
+        except csv.Error:
+            self.separador = csv.Sniffer().sniff("\n".join(linhas_texto[:50]), delimiters=";,\t|").delimiter
+
+        # (número da linha no arquivo, campos) das linhas não vazias, como o read_csv as enxerga
+        self.linhas = [(i, next(csv.reader([linha], delimiter=self.separador)))
+                       for i, linha in enumerate(self.linhas_texto) if linha]
+
+    def localizar_cabecalho(self, teste, inicio=0, limite=20):
+        """Número da linha física cujos campos satisfazem teste(campos), entre as linhas da amostra."""
+        for numero, campos in self.linhas[inicio:None if limite is None else inicio + limite]:
+            if teste(campos):
+                return numero
+        return None
+
+    def _abrir(self, skiprows):
+        """Abre o arquivo já posicionado na linha `skiprows` (quando ela caiu na amostra)."""
+        f = open(self.path, 'rb')
+        if isinstance(skiprows, int) and 0 < skiprows < len(self.deslocamentos):
+            f.seek(self.deslocamentos[skiprows])
+            skiprows = None
+        return f, skiprows
+
+    def linha_cabecalho(self, skiprows=None):
+        """(número, campos) da linha que o read_csv(skiprows=...) toma por cabeçalho, se ela caiu na amostra."""
+        return next(((numero, campos) for numero, campos in self.linhas if numero >= (skiprows or 0)), None)
+
+    def ler_blocos(self, skiprows=None, header=0, chunksize=TAMANHO_BLOCO_CSV, usecols=None):
+        f, skiprows = self._abrir(skiprows)
+        with f, pd.read_csv(f, sep=self.separador, engine='c', encoding=self.encoding,
+                            skiprows=skiprows, header=header, chunksize=chunksize, usecols=usecols) as leitor:
+            yield from leitor
+
+    def ler(self, skiprows=None, header=0, nrows=None):
+        f, skiprows = self._abrir(skiprows)
+        with f:
+            return pd.read_csv(f, sep=self.separador, engine='c', encoding=self.encoding,
+                               skiprows=skiprows, header=header, nrows=nrows)
+
+
+def iniciar_blocos(blocos):
+    """Lê o primeiro bloco já na chamada, para que erros de leitura caiam no fallback de quem chamou."""
+    primeiro = next(blocos, None)
+    return [] if primeiro is None else itertools.chain([primeiro], blocos)
+
+
+def juntar_blocos(blocos):
+    partes = list(blocos)
+    if not partes: return TabelaLeve.de_linhas([]) if pd is None else pd.DataFrame(columns=COLUNAS_SAIDA)
+    if isinstance(partes[0], TabelaLeve): return TabelaLeve.juntar(partes)
+    return pd.concat(partes) if len(partes) > 1 else partes[0]
+
+
+def juntar_compactos(blocos):
+    """juntar_blocos para blocos compactados um a um (cache): a coluna que ficou compacta em um bloco e em texto
+    em outro volta ao texto em todos antes de juntar."""
+    partes = list(blocos)
+    for nome in COLUNAS_SAIDA:
+        if len({str(df[nome].dtype) for df in partes if nome in df.columns}) > 1:
+            for df in partes:
+                if df[nome].dtype != object: df[nome] = colunas_exportacao(df[[nome]])[0]
+    return juntar_blocos(partes)
+
+
+# --- LEITURA DE XLSX EM STREAMING ---
+# O pd.read_excel monta a aba inteira em listas e depois num DataFrame antes de qualquer filtro (GBs numa
+# planilha de 1M de linhas). Aqui o xlsx é percorrido linha a linha (openpyxl read-only, só valores) e
+# entregue em blocos de TAMANHO_BLOCO_CSV linhas, como o CSV: o pico de memória fica no tamanho do bloco.
+# As células são convertidas como o read_excel converte e cada bloco passa pelo mesmo TextParser, então os
+# tipos e o resultado da limpeza são os mesmos da SessaoPlanilha (que segue atendendo o .xls).
+ERROS_EXCEL = frozenset(["#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A"])
+
+
+def eh_xlsx(path):
+    """xlsx pelos bytes iniciais; False também quando o arquivo não pode ser lido (o leitor de sempre informa o erro)."""
+    try:
+        with open(path, 'rb') as f:
+            return ENGINES_PLANILHA.get(f.read(4)) == "openpyxl"
+    except OSError:
+        return False
+
+
+def valor_xlsx(valor):
+    """Célula como o pd.read_excel(dtype=object) a entrega: vazia, erro ou nula vira "" e número inteiro vira int."""
+    if valor is None: return ""
+    if isinstance(valor, str): return "" if valor in VALORES_NULOS_CSV or valor in ERROS_EXCEL else valor
+    if isinstance(valor, float) and valor.is_integer(): return int(valor)
+    return valor
+
+
+class PlanilhaStreaming:
+    def __init__(self, path):
+        from openpyxl import load_workbook
+        self.path = path
+        self.wb = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+
+    @property
+    def sheet_names(self):
+        return self.wb.sheetnames
+
+    def linhas(self, aba=0):
+        """Linhas da aba (posição ou nome) sem os vazios do fim de cada linha; as linhas vazias do fim da aba
+        são descartadas, como no read_excel."""
+        ws = self.wb[aba] if isinstance(aba, str) else self.wb.worksheets[aba]
+        ws.reset_dimensions()  # a dimensão gravada no arquivo pode estar errada: lê até a última célula real
+        vazias = 0
+        for valores in ws.iter_rows(values_only=True):
+            linha = [valor_xlsx(v) for v in valores]
+            while linha and linha[-1] == "": linha.pop()
+            if not linha:
+                vazias += 1
+                continue
+            for _ in range(vazias): yield []
+            vazias = 0
+            yield linha
+
+    def primeira_linha(self, aba=0):
+        return next(self.linhas(aba), None)
+
+    def fechar(self):
+        self.wb.close()
+
+
+def blocos_planilha(linhas, cabecalho, usecols=None, tamanho=TAMANHO_BLOCO_CSV, cabecalho_como_dado=False):
+    """DataFrames de até `tamanho` linhas, cada um lido pelo TextParser com a linha `cabecalho` por cima (mesmos
+    nomes e tipos que a aba inteira com header nessa linha). Há sempre ao menos um bloco, mesmo sem dados.
+
+    cabecalho_como_dado: imita a leitura com header=None (Alfa), em que o cabeçalho é mais uma linha de dados
+    e entra na inferência de tipos (coluna com texto no cabeçalho fica object); colunas numeradas.
+    """
+    from pandas.io.parsers import TextParser
+    largura = len(cabecalho)
+    primeiro = True
+    while True:
+        bloco = list(itertools.islice(linhas, tamanho))
+        if not bloco and not primeiro: return
+        primeiro = False
+        # Todas as linhas na mesma largura (como o read_excel completa a aba): linha mais larga que o
+        # cabeçalho não vira índice e as posições das colunas valem para todos os blocos
+        largura = max([largura] + [len(linha) for linha in bloco])
+        brutas = [linha + [""] * (largura - len(linha)) for linha in [cabecalho] + bloco]
+        if cabecalho_como_dado:
+            yield TextParser(brutas, header=None, usecols=usecols, skip_blank_lines=False).read().iloc[1:]
+        else:
+            yield TextParser(brutas, header=0, usecols=usecols, skip_blank_lines=False).read()
+
+
+def renomear_colunas(blocos, nomes):
+    """Troca os nomes das colunas de cada bloco por `nomes` (completados com "nan", o nome de célula vazia)."""
+    for df in blocos:
+        df.columns = (list(nomes) + ["nan"] * len(df.columns))[:len(df.columns)]
+        yield df
+
+
+# --- CAMINHO LEVE (SEM PANDAS) ---
+# Excellence, Lista Cargas em CSV e Alfa em CSV são limpos só com csv/re enquanto o pandas ainda carrega
+# (a janela já processa no primeiro segundo). O resultado é o mesmo, byte a byte, do caminho com pandas;
+# o que o caminho leve não reproduz com certeza levanta CaminhoLeveIndisponivel e o chamador refaz com o pandas.
+VALORES_NULOS_CSV = frozenset(["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+                               "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"])  # na_values do read_csv
+RE_NF_INTEIRA = re.compile(r'[+-]?\d{1,15}')  # números que o read_csv converte sem mudar o resultado da NF
+
+
+class CaminhoLeveIndisponivel(Exception):
+    pass
+
+
+class TabelaLeve:
+    """Resultado do caminho leve: colunas em listas, com a parte da interface de DataFrame que a
+    pré-visualização, a exportação e a base local usam (columns, len, empty, iloc[a:b], insert)."""
+
+    def __init__(self, colunas):
+        self.colunas = colunas  # {nome: lista de valores}, na ordem das colunas
+
+    @classmethod
+    def de_linhas(cls, linhas, nomes=COLUNAS_SAIDA):
+        valores = list(zip(*linhas)) if linhas else [()] * len(nomes)
+        return cls({nome: list(coluna) for nome, coluna in zip(nomes, valores)})
+
+    @classmethod
+    def juntar(cls, partes):
+        return cls({nome: [v for parte in partes for v in parte.colunas[nome]] for nome in partes[0].columns})
+
+    @property
+    def columns(self):
+        return list(self.colunas)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def iloc(self):
+        return self  # só fatias de linhas: tabela.iloc[a:b]
+
+    def __len__(self):
+        return len(next(iter(self.colunas.values()), ()))
+
+    def __getitem__(self, chave):
+        if isinstance(chave, slice): return TabelaLeve({n: v[chave] for n, v in self.colunas.items()})
+        if isinstance(chave, list): return TabelaLeve({n: self.colunas[n] for n in chave})
+        return self.colunas[chave]
+
+    def insert(self, posicao, nome, valores):
+        itens = list(self.colunas.items())
+        itens.insert(posicao, (nome, list(valores)))
+        self.colunas = dict(itens)
+
+    def reset_index(self, drop=True, inplace=False):
+        return None if inplace else self  # não há índice para refazer
+
+    def compactar(self):
+        """compactar_resultado sem numpy: NF de 6 dígitos em array('L') e datas em ordinais array('l') (0 = vazio)."""
+        for nome, valores in self.colunas.items():
+            if nome not in COLUNAS_SAIDA or not isinstance(valores, list): continue
+            if nome == "Nr. Doc.":
+                if nf_fixa(valores): self.colunas[nome] = array('L', map(int, valores))
+            else:
+                ordinais = ordinais_datas(valores)
+                if ordinais is not None: self.colunas[nome] = ordinais
+        return self
+
+    def colunas_texto(self, com_item=False):
+        colunas = []
+        for nome, valores in self.colunas.items():
+            if nome == "ITEM" and not com_item: continue
+            if isinstance(valores, array):
+                valores = [f"{v:06d}" for v in valores] if nome == "Nr. Doc." else texto_ordinais(valores)
+            colunas.append(valores)
+        return colunas
+
+
+def linha_em_branco(campos):
+    # Mesmo critério do skip_blank_lines do read_csv: linha vazia ou só com espaços
+    return not campos or (len(campos) == 1 and not campos[0].strip())
+
+
+def texto_numerico(texto):
+    try:
+        float(texto)
+        return True
+    except ValueError:
+        return False
+
+
+def normalizar_nf_valor(valor, cortar_serie=False, truncar=True, manter_texto=False, so_digitos=True):
+    """normalizar_nf para um único valor lido como texto (None = vazio do CSV)."""
+    s = "nan" if valor is None else valor.strip()
+    if not so_digitos:
+        s = RE_DECIMAL_FINAL.sub('', s)
+        return s.zfill(6) if s.isdigit() else s
+    if s == '' or s.lower() == 'nan': return ''
+    s = RE_DECIMAL_FINAL.sub('', s)
+    if cortar_serie: s = s.split('-', 1)[0].strip()
+    numeros = RE_NAO_DIGITO.sub('', s)
+    if not numeros: return s if manter_texto else ''
+    formatado = numeros.zfill(6)
+    return formatado[-6:] if truncar else formatado
+
+
+def formatar_data_leve(valor):
+    """formatar_datas (estrito) para um único valor lido como texto."""
+    if valor is None: return ""
+    s = valor.strip()
+    if " " in s: s = s.split(" ")[0]
+    for fmt, _ in FORMATOS_DATA_ESTRITO:
+        try:
+            return datetime.strptime(s, fmt).strftime(FORMATO_SAIDA_DATA)
+        except ValueError:
+            continue
+    return ""
+
+
+def linhas_leves(registros, largura):
+    """Linhas de dados como o read_csv as entrega: vazios do CSV viram None e linhas curtas são completadas."""
+    for campos in registros:
+        if linha_em_branco(campos): continue
+        # Linha mais larga que o cabeçalho vira índice no read_csv: só o pandas reproduz
+        if len(campos) > largura: raise CaminhoLeveIndisponivel()
+        linha = [None if c in VALORES_NULOS_CSV else c for c in campos]
+        if len(linha) < largura: linha.extend([None] * (largura - len(linha)))
+        yield linha
+
+
+def exigir_texto_leve(path):
+    """Planilha (ou arquivo que nem abre) fica com o caminho do pandas, que já trata e reporta esses casos."""
+    try:
+        planilha = eh_planilha(path)
+    except OSError:
+        planilha = True
+    if planilha: raise CaminhoLeveIndisponivel()
+
+
+def ler_csv_leve(path, separador, encoding):
+    """Nomes das colunas (1ª linha não vazia, como header=0) seguidos das linhas de dados, em streaming."""
+    with open(path, 'r', encoding=encoding, newline='') as f:
+        registros = csv.reader(f, delimiter=separador)
+        nomes = next((campos for campos in registros if not linha_em_branco(campos)), None)
+        if nomes is None: return
+        yield [nome or f"Unnamed: {i}" for i, nome in enumerate(nomes)]  # cabeçalho vazio, como no read_csv
+        yield from linhas_leves(registros, len(nomes))
+
+
+# --- RELATÓRIO TXT EXCELLENCE ---
+# Linha de dados: "... <nota 4-9 dígitos> ... dd/mm dd/mm" (previsão e entrega, sem ano).
+# A nota é o 1º token numérico de 4 a 9 dígitos precedido de espaço; as datas são o ÚLTIMO par dd/mm.
+# As duas regex são lineares (lookbehind no lugar de \s+ solto e .* ancorado num único ponto de partida).
+RE_NOTA_EXCELLENCE = re.compile(r'(?<=\s)(\d{4,9})\s')
+RE_DATAS_EXCELLENCE = re.compile(r'.*(\d{2}/\d{2})\s+(\d{2}/\d{2})')
+
+
+def ano_relatorio(mes, hoje, futuro=True):
+    """Ano de um dd/mm sem ano: o de hoje, exceto na virada dez/jan (dezembro lido em janeiro é do ano anterior;
+    janeiro lido em dezembro é do seguinte, só quando a data pode estar no futuro, como a previsão)."""
+    if hoje.month == 1 and mes == 12: return hoje.year - 1
+    if futuro and hoje.month == 12 and mes == 1: return hoje.year + 1
+    return hoje.year
+
+
+def formatar_dia_mes(dia_mes, memo, hoje, futuro=True):
+    """'dd/mm' -> 'dd/mm/aaaa 00:00' (None se a data não existe), guardado no memo: um relatório tem poucas datas distintas."""
+    dia, mes = int(dia_mes[:2]), int(dia_mes[3:])
+    try:
+        memo[dia_mes] = datetime(ano_relatorio(mes, hoje, futuro), mes, dia).strftime(FORMATO_SAIDA_DATA)
+    except ValueError:
+        memo[dia_mes] = None
+    return memo[dia_mes]
+
+
+def ler_blocos_excellence(path, hoje=None, tamanho=TAMANHO_BLOCO_CSV, leve=False):
+    """Lê o relatório linha a linha (sem carregar o arquivo inteiro) e devolve DataFrames de até `tamanho` linhas
+    (TabelaLeve com leve=True)."""
+    montar = TabelaLeve.de_linhas if leve else lambda dados: pd.DataFrame(dados, columns=COLUNAS_SAIDA)
+    hoje = hoje or datetime.now()
+    memo, memo_entrega = {}, {}  # a entrega nunca vai para o ano seguinte: memo próprio
+    dados = []
+    with open(path, 'r', encoding='latin1') as f:
+        for linha in f:
+            if "NFISCAL" in linha or "EXCELLENCE" in linha: continue
+            nota = RE_NOTA_EXCELLENCE.search(linha)
+            if not nota: continue
+            datas = RE_DATAS_EXCELLENCE.match(linha, nota.end())
+            if not datas: continue
+            prev, ent = datas.groups()
+            prev = memo[prev] if prev in memo else formatar_dia_mes(prev, memo, hoje)
+            ent = memo_entrega[ent] if ent in memo_entrega else formatar_dia_mes(ent, memo_entrega, hoje, False)
+            if prev is None or ent is None: continue
+            dados.append((nota.group(1).zfill(6)[-6:], prev, ent))
+            if len(dados) >= tamanho:
+                yield montar(dados)
+                dados = []
+    if dados: yield montar(dados)
+
+
+# --- PLANOS DE EXTRAÇÃO ---
+# Cada transportadora é descrita por dados: como achar o cabeçalho, quais colunas usar
+# (alternativas em ordem de preferência) e as regras de NF/datas/filtros.
+# "tem" é uma lista de grupos (cada grupo casa se QUALQUER termo aparecer; todos os grupos são exigidos),
+# "sem" lista termos proibidos e "igual" exige o nome exato da coluna/célula.
+# "leitor_leve" é o leitor do CAMINHO LEVE, usado enquanto o pandas não carregou (CSV/TXT simples).
+# As especificações são compiladas uma única vez em PLANOS (regex prontas + transformações vetoriais).
+ESPECIFICACOES_LAYOUT = {
+    "ALFA": {
+        "rotulo": "Alfa Transportes", "icone": "🚛", "cor": COLORS["accent_blue"],
+        "leitor": "_ler_alfa", "leitor_leve": "_blocos_leves_alfa",
+        "cabecalho": {"igual": "Nro.Doc"},
+        "colunas": {
+            "Nr. Doc.": [{"igual": "NRO.DOC"}],
+            "Data de Previsão de Entrega": [{"igual": "DT.EMTREGA"}],
+            "Data Entrega": [{"igual": "DT.EMTREGA"}],
+        },
+        "nf": {"so_digitos": False},
+        "descartar_nulos": True, "descartar_contendo": "Nro.Doc",
+        "erro_cabecalho": "Layout ALFA inválido.",
+    },
+    "TNT": {
+        "rotulo": "TNT Mercúrio", "icone": "📦", "cor": COLORS["accent_orange"],
+        "encoding": "utf-8",
+        "cabecalho": {"tem": [["NOTA"], ["SERIE", "SÉRIE"]], "linhas": 20, "obrigatorio": True},
+        "colunas": {
+            "Nr. Doc.": [{"tem": [["NOTA"], ["SERIE", "SÉRIE"]]}],
+            "Data de Previsão de Entrega": [{"tem": [["PREVIS"]]}],
+            "Data Entrega": [{"tem": [["DATA"], ["FINALIZA"]]}],
+        },
+        "nf": {"cortar_serie": True, "truncar": False, "manter_texto": True},
+        "descartar_vazios": True,
+        "erro_leitura": "Erro ao ler TNT: {e}",
+        "erro_cabecalho": "Não encontrei a linha de cabeçalho 'NOTA/SERIE'.",
+        "erro_nf": "Coluna NOTA/SERIE não encontrada.",
+    },
+    "AGE": {
+        "rotulo": "AGE / MH Logística", "icone": "📝", "cor": "#04b0e4",
+        "leitor": "_ler_blocos_mh",
+        # A 1ª linha já é o cabeçalho padrão: no CSV procura nas 30 seguintes
+        "cabecalho": {"tem": [PALAVRAS_CABECALHO_NF], "inicio": 1, "linhas": 30},
+        "colunas": {
+            "Nr. Doc.": [{"tem": [["N.FISCAL", "NFISCAL", "NOTA", "DOC", "NFE"]]}],
+            "Data de Previsão de Entrega": [{"tem": [["PREV"]]}],
+            "Data Entrega": [{"tem": [["ENTREGA"]], "sem": ["PREV"]}, {"tem": [["DATA"], ["BAIXA", "REALIZ"]]}],
+        },
+        # Suporta ano com 2 dígitos (ex: 27/11/25 -> 27/11/2025)
+        "datas_flexiveis": True,
+        "descartar_vazios": True, "descartar_zeros": True,
+        "erro_nf": "Coluna de Nota Fiscal não encontrada.\nColunas no arquivo: [{colunas}]",
+    },
+    "TXT_EXCELLENCE": {
+        "rotulo": "Excellence (Texto)", "icone": "📄", "cor": "#2C3E50",
+        "leitor": "_blocos_txt_excellence", "leitor_leve": "_blocos_leves_excellence",
+        "depende_data": True,  # o ano das datas dd/mm sai da data de hoje
+    },
+    "LISTA_CARGAS": {
+        "rotulo": "Lista de Cargas", "icone": "📋", "cor": COLORS["accent_teal"],
+        "leitor_leve": "_blocos_leves_csv",
+        "colunas": {
+            "Nr. Doc.": [{"tem": [["NOTA", "NF", "DOCUMENTO", "NR_NOTA"]]}],
+            "Data de Previsão de Entrega": [{"tem": [["PREV"]]}],
+            # Entrega que NÃO seja a previsão; senão DATA_REALIZADA ou BAIXA
+            "Data Entrega": [{"tem": [["ENTREGA"]], "sem": ["PREV"]}, {"tem": [["REALIZ", "BAIXA"]]}],
+        },
+        "descartar_vazios": True, "descartar_zeros": True,
+        "erro_leitura": "Não foi possível ler o arquivo Lista Cargas: {e}",
+        "erro_nf": "Não encontrei a coluna de Nota Fiscal/Documento no arquivo.",
+    },
+}
+ESPECIFICACOES_LAYOUT["LT"] = dict(ESPECIFICACOES_LAYOUT["AGE"], rotulo="LT (Donizete)", icone="📑",
+                                   cor=COLORS["accent_purple"])
+ESPECIFICACOES_LAYOUT["MH"] = ESPECIFICACOES_LAYOUT["AGE"]
+
+
+def compilar_regra(regra):
+    """Transforma {"tem": [[...], ...], "sem": [...]} ou {"igual": ...} numa única regex ancorada."""
+    if "igual" in regra:
+        return re.compile(re.escape(regra["igual"]) + r"\Z")
+    padrao = "".join("(?=.*(?:%s))" % "|".join(re.escape(t) for t in grupo) for grupo in regra.get("tem", []))
+    padrao += "".join("(?!.*%s)" % re.escape(t) for t in regra.get("sem", []))
+    return re.compile(padrao, re.DOTALL)
+
+
+class PlanoExtracao:
+    """Especificação de layout já compilada: resolve colunas uma vez e aplica as transformações em bloco."""
+
+    def __init__(self, layout, spec):
+        self.layout = layout
+        self.spec = spec
+        self.leitor = spec.get("leitor")
+        self.leitor_leve = spec.get("leitor_leve")
+        self.encoding = spec.get("encoding", "latin1")
+        cabecalho = spec.get("cabecalho")
+        self.cabecalho = None
+        if cabecalho:
+            self.cabecalho = compilar_regra(cabecalho)
+            self.cabecalho_celula = "igual" in cabecalho
+            self.cabecalho_inicio = cabecalho.get("inicio", 0)
+            self.cabecalho_linhas = cabecalho.get("linhas")
+            self.cabecalho_obrigatorio = cabecalho.get("obrigatorio", False)
+        self.colunas = [(campo, [compilar_regra(r) for r in regras]) for campo, regras in spec.get("colunas", {}).items()]
+        self.nf = spec.get("nf", {})
+        self.flexivel = spec.get("datas_flexiveis", False)
+
+    def eh_cabecalho(self, campos):
+        if self.cabecalho_celula:
+            return any(self.cabecalho.match(str(c).strip()) for c in campos)
+        return self.cabecalho.match(" ".join(str(c).upper() for c in campos)) is not None
+
+    def localizar_cabecalho(self, linhas):
+        """Posição da linha de cabeçalho entre as primeiras linhas (valores de um DataFrame ou listas); None se não achar."""
+        for pos, valores in enumerate(linhas[:self.cabecalho_linhas]):
+            if self.eh_cabecalho(valores):
+                return pos
+        return None
+
+    def resolver_colunas(self, nomes):
+        """Posição de cada campo de saída (None quando a coluna não existe); a NF é obrigatória."""
+        posicoes = {}
+        for campo, regras in self.colunas:
+            posicoes[campo] = next((i for regra in regras for i, nome in enumerate(nomes) if regra.match(nome)), None)
+            if posicoes[campo] is None and campo == "Nr. Doc.":
+                raise Exception(self.spec.get("erro_nf", "Coluna de Nota Fiscal não encontrada.").format(
+                    colunas=", ".join(nomes)))
+        return posicoes
+
+    def extrair(self, df, posicoes):
+        col_nf = posicoes["Nr. Doc."]
+        if self.spec.get("descartar_nulos"): df = df[df.iloc[:, col_nf].notna()]
+        if self.spec.get("descartar_contendo"):
+            df = df[~df.iloc[:, col_nf].astype(str).str.contains(self.spec["descartar_contendo"], regex=False)]
+
+        df_final = pd.DataFrame()
+        df_final["Nr. Doc."] = normalizar_nf(df.iloc[:, col_nf], **self.nf)
+        for campo in COLUNAS_SAIDA[1:]:
+            pos = posicoes[campo]
+            df_final[campo] = formatar_datas(df.iloc[:, pos], flexivel=self.flexivel) if pos is not None else ""
+
+        if self.spec.get("descartar_vazios"): df_final = df_final[df_final["Nr. Doc."].astype(bool)]
+        if self.spec.get("descartar_zeros"): df_final = df_final[df_final["Nr. Doc."] != "000000"]
+        return df_final[COLUNAS_SAIDA].fillna("")
+
+    def processar(self, blocos):
+        if not self.colunas:
+            yield from blocos
+            return
+        posicoes = None
+        for df in blocos:
+            df.columns = [str(c).upper().strip() for c in df.columns]
+            if posicoes is None: posicoes = self.resolver_colunas(list(df.columns))
+            yield self.extrair(df, posicoes)
+
+    def extrair_leve(self, linhas, posicoes, memo_datas):
+        """extrair() linha a linha sobre texto (caminho leve), com as mesmas regras e o mesmo resultado."""
+        if self.flexivel: raise CaminhoLeveIndisponivel()
+        col_nf = posicoes["Nr. Doc."]
+        col_datas = [posicoes[campo] for campo in COLUNAS_SAIDA[1:]]
+        descartar_nulos = self.spec.get("descartar_nulos")
+        contendo = self.spec.get("descartar_contendo")
+        descartar_vazios = self.spec.get("descartar_vazios")
+        descartar_zeros = self.spec.get("descartar_zeros")
+        # NF com casas decimais numa coluna só de números: o read_csv a converteria para float e mudaria o texto
+        notas = [linha[col_nf] for linha in linhas if linha[col_nf] is not None]
+        if any(not RE_NF_INTEIRA.fullmatch(v) for v in notas) and all(texto_numerico(v) for v in notas):
+            raise CaminhoLeveIndisponivel()
+        dados = []
+        for linha in linhas:
+            bruto = linha[col_nf]
+            if bruto is None and descartar_nulos: continue
+            if contendo and contendo in ("nan" if bruto is None else bruto): continue
+            nf = normalizar_nf_valor(bruto, **self.nf)
+            if descartar_vazios and not nf: continue
+            if descartar_zeros and nf == "000000": continue
+            datas = []
+            for pos in col_datas:
+                valor = None if pos is None else linha[pos]
+                if valor not in memo_datas: memo_datas[valor] = formatar_data_leve(valor)
+                datas.append(memo_datas[valor])
+            dados.append((nf, *datas))
+        return TabelaLeve.de_linhas(dados)
+
+    def processar_leve(self, linhas):
+        """processar() para o caminho leve: a 1ª linha do iterador traz os nomes das colunas, as demais são texto."""
+        nomes = next(linhas, None)
+        posicoes = None
+        memo_datas = {}
+        while True:
+            bloco = list(itertools.islice(linhas, TAMANHO_BLOCO_CSV))
+            if not bloco: return
+            if posicoes is None: posicoes = self.resolver_colunas([str(c).upper().strip() for c in nomes])
+            yield self.extrair_leve(bloco, posicoes, memo_datas)
+
+
+PLANOS = {layout: PlanoExtracao(layout, spec) for layout, spec in ESPECIFICACOES_LAYOUT.items()}
+
+
+# --- CACHE DE RESULTADOS ---
+# O resultado limpo (3 colunas) fica guardado por hash do CONTEÚDO + layout + versão da limpeza:
+# o mesmo arquivo reenviado (ou reaberto depois de uma queda) não passa de novo pela leitura/limpeza.
+# Mexeu em alguma regra de limpeza que não está nas ESPECIFICACOES_LAYOUT? Suba a VERSAO_LIMPEZA.
+# Cada entrada é uma sequência de blocos em pickle, gravados conforme passam (a memória é a de um bloco, seja
+# qual for o tamanho do arquivo) e lidos de volta também um a um.
+VERSAO_LIMPEZA = "23.16.2"
+PASTA_CACHE_RESULTADOS = os.path.join(os.path.expanduser("~"), ".logistica_cache")
+LIMITE_CACHE_RESULTADOS = 512 * 1024 * 1024  # bytes em disco; os menos usados saem primeiro
+
+
+def hash_conteudo(path, tamanho_bloco=1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for parte in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(parte)
+    return h.hexdigest()
+
+
+class CacheResultados:
+    def __init__(self, pasta=PASTA_CACHE_RESULTADOS, limite=LIMITE_CACHE_RESULTADOS):
+        self.pasta = pasta
+        self.limite = limite
+
+    def chave(self, path, layout):
+        spec = ESPECIFICACOES_LAYOUT.get(layout, {})
+        partes = [hash_conteudo(path), str(layout), VERSAO_LIMPEZA, repr(sorted(spec.items()))]
+        if spec.get("depende_data"): partes.append(datetime.now().strftime("%Y-%m"))
+        return hashlib.sha1("|".join(partes).encode("utf-8")).hexdigest()
+
+    def _arquivo(self, chave):
+        return os.path.join(self.pasta, chave + ".pkl")
+
+    def carregar(self, chave):
+        """Blocos do resultado guardado, lidos do disco conforme são consumidos (None se não houver)."""
+        arquivo = self._arquivo(chave)
+        if not os.path.exists(arquivo): return None
+        carregar_pandas()
+        f = None
+        try:
+            f = open(arquivo, "rb")
+            primeiro = pickle.load(f)  # entrada ilegível conta como ausente (e sai do cache)
+            os.utime(arquivo)  # marca como usado agora (ordem do LRU)
+        except:
+            if f is not None: f.close()
+            try:
+                os.remove(arquivo)
+            except OSError:
+                pass
+            return None
+        return self._blocos(f, primeiro)
+
+    def _blocos(self, f, primeiro):
+        with f:
+            yield primeiro
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    return
+
+    def gravando(self, chave, blocos):
+        """Repassa os blocos gravando cada um (compactado) num temporário, que só vira a entrada da chave se a
+        leitura chegar ao fim. Falha ao gravar desiste do cache, não do processamento."""
+        temporario = f"{self._arquivo(chave)}.{os.getpid()}.tmp"
+        f = None
+        try:
+            try:
+                os.makedirs(self.pasta, exist_ok=True)
+                f = open(temporario, "wb")
+            except OSError:
+                pass
+            for df in blocos:
+                if f is not None:
+                    try:
+                        # Cópia rasa: o bloco repassado continua com as colunas em texto
+                        pickle.dump(compactar_resultado(df.copy(deep=False)), f, protocol=pickle.HIGHEST_PROTOCOL)
+                    except:
+                        f.close()
+                        f = None
+                        os.remove(temporario)
+                yield df
+            if f is not None:
+                f.close()
+                f = None
+                try:
+                    os.replace(temporario, self._arquivo(chave))
+                    self.podar()
+                except:
+                    pass  # cache é só atalho: falhar aqui não pode derrubar o processamento
+        finally:
+            if f is not None:  # leitura interrompida (erro ou cancelamento): nada entra no cache
+                f.close()
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+
+    def podar(self):
+        entradas = []
+        for nome in os.listdir(self.pasta):
+            if not nome.endswith(".pkl"): continue
+            try:
+                info = os.stat(os.path.join(self.pasta, nome))
+            except OSError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, nome))
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, nome in sorted(entradas):
+            if total <= self.limite: break
+            try:
+                os.remove(os.path.join(self.pasta, nome))
+                total -= tamanho
+            except OSError:
+                pass
+
+
+# --- ESQUEMAS APRENDIDOS (PROJEÇÃO DE COLUNAS) ---
+# As transportadoras quase nunca mudam o formato do relatório. Para cada formato já visto (assinatura =
+# layout + linha do cabeçalho + campos exatos dessa linha) fica guardado em quais posições estão NF,
+# previsão e entrega: nos próximos arquivos do mesmo formato a leitura converte só essas colunas (usecols)
+# em vez das ~40 do relatório. Cabeçalho diferente = formato novo, resolvido pelas regras do plano e
+# aprendido. A assinatura inclui a VERSAO_LIMPEZA e a especificação do layout, como o cache de resultados.
+ARQUIVO_ESQUEMAS = os.path.join(PASTA_CACHE_RESULTADOS, "esquemas.json")
+LIMITE_ESQUEMAS = 200  # formatos guardados; os aprendidos há mais tempo saem primeiro
+
+
+class EsquemasAprendidos:
+    def __init__(self, caminho=ARQUIVO_ESQUEMAS, limite=LIMITE_ESQUEMAS):
+        self.caminho = caminho
+        self.limite = limite
+        self._esquemas = None
+
+    def _ler(self):
+        try:
+            with open(self.caminho, "r") as f:
+                esquemas = json.load(f)
+            return esquemas if isinstance(esquemas, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    @property
+    def esquemas(self):
+        if self._esquemas is None: self._esquemas = self._ler()
+        return self._esquemas
+
+    def assinatura(self, plano, linha, campos):
+        partes = [plano.layout, VERSAO_LIMPEZA, repr(sorted(plano.spec.items())), str(linha)]
+        return hashlib.sha1("\x1f".join(partes + [str(c) for c in campos]).encode("utf-8")).hexdigest()
+
+    def linhas_conhecidas(self, plano):
+        """Linhas de cabeçalho já vistas neste layout (onde vale a pena conferir a assinatura)."""
+        return sorted({e["linha"] for e in self.esquemas.values() if e.get("layout") == plano.layout})
+
+    def procurar(self, plano, linha, campos):
+        """Posições das colunas usadas (usecols) se este cabeçalho já é conhecido; None se não."""
+        esquema = self.esquemas.get(self.assinatura(plano, linha, campos))
+        return esquema["colunas"] if esquema else None
+
+    def colunas(self, plano, linha, campos, ler_nomes):
+        """procurar(); num formato novo, ler_nomes() devolve os nomes das colunas como o pandas os dá, o plano
+        as resolve e o esquema é guardado. None quando as regras não resolvem (a leitura completa informa o erro)."""
+        usecols = self.procurar(plano, linha, campos)
+        if usecols is not None: return usecols
+        try:
+            posicoes = plano.resolver_colunas([str(c).upper().strip() for c in ler_nomes()])
+        except:
+            return None
+        usecols = sorted({pos for pos in posicoes.values() if pos is not None})
+        self.aprender(self.assinatura(plano, linha, campos),
+                      {"layout": plano.layout, "linha": linha, "colunas": usecols, "aprendido": time.time()})
+        return usecols
+
+    def aprender(self, chave, esquema):
+        try:
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+            with travar_arquivo(self.caminho):
+                esquemas = self._ler()  # outra instância pode ter aprendido algo desde a nossa leitura
+                esquemas[chave] = esquema
+                if len(esquemas) > self.limite:
+                    recentes = sorted(esquemas, key=lambda k: esquemas[k].get("aprendido", 0))[-self.limite:]
+                    esquemas = {k: esquemas[k] for k in recentes}
+                gravar_atomico(self.caminho, json.dumps(esquemas))
+            self._esquemas = esquemas
+        except:
+            pass  # como o cache de resultados: sem esquema a leitura só fica completa
+
+
+# --- INSTRUMENTAÇÃO POR ETAPA ---
+# Cada execução mede tempo, linhas e variação de memória de cada etapa (detectar, ler, limpar, juntar,
+# pré-visualização, gravar...). O tempo é EXCLUSIVO: quando "gravar" puxa os blocos de "limpar", que
+# puxa os de "ler", cada etapa fica só com o seu pedaço. Os registros vão para um JSON-lines rotativo.
+# Perfil opcional (--perfil ou LOGISTICA_PERFIL=cprofile|tracemalloc): relatório da etapa mais lenta.
+LOG_DESEMPENHO = os.path.join(os.path.expanduser("~"), "logistica_desempenho.jsonl")
+TAMANHO_LOG_DESEMPENHO = 5 * 1024 * 1024
+COPIAS_LOG_DESEMPENHO = 3
+MODOS_PERFIL = ("cprofile", "tracemalloc")
+
+
+def memoria_atual_mb():
+    """Memória residente atual do processo (None se a plataforma não informa)."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def perfil_solicitado(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--perfil" in argv:
+        i = argv.index("--perfil")
+        if i + 1 < len(argv) and argv[i + 1] in MODOS_PERFIL: return argv[i + 1]
+    modo = os.environ.get("LOGISTICA_PERFIL", "").strip().lower()
+    return modo if modo in MODOS_PERFIL else None
+
+
+class MedidorEtapas:
+    def __init__(self, arquivo=None, layout=None, perfil=None):
+        self.arquivo = arquivo
+        self.layout = layout
+        self.perfil = perfil
+        self.etapas = OrderedDict()  # nome -> {"s", "linhas", "mem_mb", "chamadas"}
+        self.arquivo_perfil = None
+        self._pilha = []  # [nome, tempo dos filhos, profiler]
+        self._perfis = {}  # nome -> pstats / (snapshot, pico)
+        self._base_tracemalloc = None
+        if perfil == "tracemalloc":
+            import tracemalloc
+            if not tracemalloc.is_tracing(): tracemalloc.start(10)
+            self._base_tracemalloc = tracemalloc.take_snapshot()
+
+    def _entrar(self, nome):
+        quadro = [nome, 0.0, None, time.perf_counter(), memoria_atual_mb()]
+        if self.perfil == "cprofile":
+            import cProfile
+            if self._pilha and self._pilha[-1][2] is not None: self._pilha[-1][2].disable()
+            quadro[2] = cProfile.Profile()
+            quadro[2].enable()
+        elif self.perfil == "tracemalloc":
+            import tracemalloc
+            tracemalloc.reset_peak()
+        self._pilha.append(quadro)
+
+    def _sair(self, nome, linhas=None):
+        agora = time.perf_counter()
+        quadro = self._pilha.pop()
+        decorrido = agora - quadro[3]
+        if quadro[2] is not None:
+            quadro[2].disable()
+            self._guardar_cprofile(nome, quadro[2])
+            if self._pilha and self._pilha[-1][2] is not None: self._pilha[-1][2].enable()
+        elif self.perfil == "tracemalloc":
+            self._guardar_tracemalloc(nome)
+        if self._pilha: self._pilha[-1][1] += decorrido
+        etapa = self.etapas.setdefault(nome, {"s": 0.0, "linhas": None, "mem_mb": None, "chamadas": 0})
+        etapa["s"] += decorrido - quadro[1]
+        etapa["chamadas"] += 1
+        if linhas is not None: etapa["linhas"] = (etapa["linhas"] or 0) + linhas
+        memoria = memoria_atual_mb()
+        if memoria is not None and quadro[4] is not None:
+            etapa["mem_mb"] = (etapa["mem_mb"] or 0.0) + memoria - quadro[4]
+
+    def _guardar_cprofile(self, nome, profiler):
+        import pstats
+        if nome in self._perfis: self._perfis[nome].add(profiler)
+        else: self._perfis[nome] = pstats.Stats(profiler)
+
+    def _guardar_tracemalloc(self, nome):
+        import tracemalloc
+        pico = tracemalloc.get_traced_memory()[1]
+        if nome not in self._perfis or pico > self._perfis[nome][1]:
+            self._perfis[nome] = (tracemalloc.take_snapshot(), pico)
+
+    @contextlib.contextmanager
+    def etapa(self, nome):
+        """Mede um trecho; quem chama pode informar as linhas em info["linhas"]."""
+        info = {"linhas": None}
+        self._entrar(nome)
+        try:
+            yield info
+        finally:
+            self._sair(nome, info["linhas"])
+
+    def medindo(self, blocos, nome):
+        """Repassa os blocos, contando na etapa `nome` só o tempo gasto para produzir cada um."""
+        blocos = iter(blocos)
+        while True:
+            self._entrar(nome)
+            try:
+                df = next(blocos)
+            except StopIteration:
+                self._sair(nome)
+                return
+            except BaseException:
+                self._sair(nome)
+                raise
+            self._sair(nome, len(df))
+            yield df
+
+    def total(self):
+        return sum(e["s"] for e in self.etapas.values())
+
+    def resumo(self):
+        return resumir_etapas(self.registro()["etapas"])
+
+    def registro(self):
+        return {
+            "data": datetime.now().isoformat(timespec="seconds"),
+            "arquivo": os.path.basename(self.arquivo) if self.arquivo else None,
+            "layout": self.layout,
+            "total_s": round(self.total(), 4),
+            "etapas": [{"etapa": nome, "s": round(e["s"], 4), "linhas": e["linhas"],
+                        "mem_mb": None if e["mem_mb"] is None else round(e["mem_mb"], 1), "chamadas": e["chamadas"]}
+                       for nome, e in self.etapas.items()],
+            "perfil": self.arquivo_perfil,
+        }
+
+    def gravar_perfil(self, pasta=None):
+        """Grava o relatório do perfil da etapa mais lenta (se o perfil estiver ligado). Devolve o caminho."""
+        if not self.perfil or not self._perfis: return None
+        lenta = max(self._perfis, key=lambda nome: self.etapas.get(nome, {}).get("s", 0))
+        base = os.path.splitext(os.path.basename(self.arquivo or "geral"))[0]
+        pasta = pasta or os.path.dirname(LOG_DESEMPENHO)
+        etapa = re.sub(r'\W+', '_', lenta)
+        caminho = os.path.join(pasta, f"logistica_perfil_{base}_{etapa}_{datetime.now():%Y%m%d_%H%M%S}.txt")
+        with open(caminho, "w", encoding="utf-8") as f:
+            f.write(f"Etapa mais lenta: {lenta} ({self.etapas[lenta]['s']:.3f}s) | {self.resumo()}\n\n")
+            if self.perfil == "cprofile":
+                estatisticas = self._perfis[lenta]
+                estatisticas.stream = f
+                estatisticas.sort_stats("cumulative").print_stats(40)
+            else:
+                snapshot, pico = self._perfis[lenta]
+                f.write(f"Pico de memória alocada (tracemalloc): {pico / (1024 * 1024):.1f} MB\n\n")
+                for estatistica in snapshot.compare_to(self._base_tracemalloc, "lineno")[:30]:
+                    f.write(f"{estatistica}\n")
+        self.arquivo_perfil = caminho
+        return caminho
+
+
+def resumir_etapas(etapas):
+    """'ler 1.20s | limpar 0.30s | total 1.50s | mem +45 MB' a partir da lista de etapas de um registro."""
+    partes = [f"{e['etapa']} {e['s']:.2f}s" for e in etapas]
+    texto = " | ".join(partes + [f"total {sum(e['s'] for e in etapas):.2f}s"])
+    memorias = [e["mem_mb"] for e in etapas if e["mem_mb"] is not None]
+    if memorias: texto += f" | mem {sum(memorias):+.0f} MB"
+    return texto
+
+
+_LOGGER_DESEMPENHO = None
+
+
+def registrar_desempenho(registro):
+    """Acrescenta um registro ao JSON-lines de desempenho (rotativo); falhas de log não interrompem nada."""
+    global _LOGGER_DESEMPENHO
+    try:
+        if _LOGGER_DESEMPENHO is None:
+            import logging
+            from logging.handlers import RotatingFileHandler
+            logger = logging.getLogger("logistica.desempenho")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            manipulador = RotatingFileHandler(LOG_DESEMPENHO, maxBytes=TAMANHO_LOG_DESEMPENHO,
+                                              backupCount=COPIAS_LOG_DESEMPENHO, encoding="utf-8")
+            manipulador.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(manipulador)
+            _LOGGER_DESEMPENHO = logger
+        _LOGGER_DESEMPENHO.info(json.dumps(registro, ensure_ascii=False))
+    except:
+        pass
+
+
+class ProcessamentoCancelado(Exception):
+    pass
+
+
+class MotorLimpeza:
+    """Núcleo de detecção e limpeza, sem dependência de Tk (usado pela GUI e pelo modo lote)."""
+
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self.layout_detectado = None
+        self.sessao = None
+        self.cache_resultados = CacheResultados()
+        self.chave_resultado = None
+        self.esquemas = EsquemasAprendidos()  # None = sempre lê todas as colunas
+        self.medidor = None  # MedidorEtapas da execução atual (None = sem instrumentação)
+
+    def obter_sessao(self, path=None):
+        path = path or self.file_path
+        if self.sessao is None or self.sessao.path != path:
+            self.fechar_sessao()
+            self.sessao = SessaoPlanilha(path)
+        return self.sessao
+
+    def fechar_sessao(self):
+        if self.sessao is not None: self.sessao.fechar()
+        self.sessao = None
+
+    def verificar_libs(self):
+        return pd is not None
+
+    def usa_caminho_leve(self, layout=None):
+        """True enquanto o pandas não carregou e o layout tem leitor sem pandas (CSV/TXT simples)."""
+        plano = PLANOS.get(layout or self.layout_detectado)
+        return pd is None and plano is not None and plano.leitor_leve is not None
+
+    def limpar(self, layout=None):
+        blocos = self.limpar_em_blocos(layout)
+        return None if blocos is None else juntar_blocos(blocos)
+
+    def resultado_em_cache(self, layout=None):
+        """Blocos do resultado limpo já guardado para este conteúdo/layout/versão (None se não houver)."""
+        self.chave_resultado = None
+        # O cache guarda DataFrames (abri-lo carregaria o pandas): no caminho leve limpar direto é mais rápido
+        if self.cache_resultados is None or self.usa_caminho_leve(layout): return None
+        try:
+            self.chave_resultado = self.cache_resultados.chave(self.file_path, layout or self.layout_detectado)
+        except OSError:
+            return None
+        return self.cache_resultados.carregar(self.chave_resultado)
+
+    def guardando_em_cache(self, blocos):
+        """Repassa os blocos e, se a leitura chegar ao fim, guarda o resultado na chave de resultado_em_cache()."""
+        if self.chave_resultado:
+            return self.cache_resultados.gravando(self.chave_resultado, blocos)
+        return blocos
+
+    def limpar_em_blocos(self, layout=None):
+        """Devolve os blocos já limpos conforme são lidos (CSV grande sem pico de memória); None se o layout não tem plano."""
+        plano = PLANOS.get(layout or self.layout_detectado)
+        if plano is None: return None
+        if self.usa_caminho_leve(plano.layout):
+            leitor, processar = getattr(self, plano.leitor_leve), iter  # o leitor leve já devolve os blocos limpos
+        else:
+            carregar_pandas()
+            leitor = getattr(self, plano.leitor) if plano.leitor else self._blocos_plano
+            processar = plano.processar
+        if self.medidor is None: return processar(leitor(plano))
+        with self.medidor.etapa("ler"):
+            brutos = leitor(plano)
+        return self.medidor.medindo(processar(self.medidor.medindo(brutos, "ler")), "limpar")
+
+    def ler_arquivo_inteligente(self):
+        try:
+            sessao = self.obter_sessao()
+            try:
+                sheet_names = sessao.sheet_names
+            except:
+                return AmostraCSV(self.file_path).ler()
+            if len(sheet_names) >= 4:
+                try:
+                    df = sessao.ler(sheet_name=3)
+                    colunas_str = " ".join([str(c).upper() for c in df.columns])
+                    if "CTRC" in colunas_str or "N.FISCAL" in colunas_str or "NFISCAL" in colunas_str: return df
+                except:
+                    pass
+            for sheet in sheet_names:
+                df = sessao.ler(sheet_name=sheet)
+                colunas_str = " ".join([str(c).upper() for c in df.columns])
+                if "CTRC" in colunas_str and ("N.FISCAL" in colunas_str or "NFISCAL" in colunas_str): return df
+            return sessao.ler(sheet_name=0)
+        except Exception as e:
+            try:
+                return AmostraCSV(self.file_path).ler()
+            except:
+                raise Exception(f"Erro Crítico na leitura: {e}")
+
+    def identificar_layout(self, path):
+        nome_arq = os.path.basename(path).upper()
+
+        # Identificação por nome do arquivo
+        layout = casar_assinaturas(nome_arq, ASSINATURAS_NOME, RE_TOKENS_NOME)
+        if layout: return layout
+
+        try:
+            chave = chave_cache_layout(path)
+        except OSError:
+            return "ERRO_LEITURA"
+        if chave in CACHE_LAYOUT:
+            CACHE_LAYOUT.move_to_end(chave)
+            return CACHE_LAYOUT[chave]
+
+        content_upper = ""
+        try:
+            if path.lower().endswith('.xlsx'):
+                try:
+                    content_upper = ler_amostra_xlsx(path)
+                except:
+                    pass
+
+            if not content_upper and path.lower().endswith(('.xls', '.xlsx')):
+                if not self.verificar_libs(): return "AGUARDANDO_LIBS"
+                try:
+                    sessao = self.obter_sessao(path)
+                    for sheet in sessao.sheet_names[:3]:
+                        df_temp = sessao.ler(sheet_name=sheet, nrows=20, header=None)
+                        content_upper += df_temp.to_string().upper() + " "
+                except:
+                    pass
+
+            if not content_upper:
+                try:
+                    with open(path, 'r', encoding='latin1', errors='ignore') as f:
+                        content_upper = f.read(5000).upper()
+                except:
+                    pass
+
+            if not content_upper: return "ERRO_LEITURA"
+
+            layout = casar_assinaturas(content_upper, ASSINATURAS_CONTEUDO, RE_TOKENS_CONTEUDO) or "DESCONHECIDO"
+            CACHE_LAYOUT[chave] = layout
+            if len(CACHE_LAYOUT) > LIMITE_CACHE_LAYOUT: CACHE_LAYOUT.popitem(last=False)
+            return layout
+        except Exception as e:
+            print(f"Erro ao identificar: {e}")
+            return "ERRO"
+
+    # --- LEITORES DOS PLANOS ---
+    def _blocos_plano(self, plano):
+        """Leitor padrão: o tipo vem dos bytes iniciais; CSV continua a leitura a partir do cabeçalho achado
+        na amostra, xlsx é lido em streaming e xls localiza o cabeçalho nas linhas já em cache da 1ª aba."""
+        try:
+            planilha = eh_planilha(self.file_path)
+        except Exception as e:
+            raise Exception(plano.spec.get("erro_leitura", "Erro na leitura: {e}").format(e=e))
+        if not planilha:
+            try:
+                amostra = AmostraCSV(self.file_path, encoding=plano.encoding)
+            except:
+                amostra = None
+            if amostra is not None:
+                linha = None
+                if plano.cabecalho:
+                    linha = amostra.localizar_cabecalho(plano.eh_cabecalho, plano.cabecalho_inicio, plano.cabecalho_linhas)
+                    if linha is None and plano.cabecalho_obrigatorio: raise Exception(plano.spec["erro_cabecalho"])
+                    if linha: amostra.farejar(linha)  # como o 2º read_csv(sep=None, skiprows=linha) original
+                try:
+                    return self._ler_csv_projetado(plano, amostra, linha)
+                except:
+                    pass
+        elif eh_xlsx(self.file_path):
+            return iniciar_blocos(self._blocos_xlsx_plano(plano))
+        try:
+            sessao = self.obter_sessao()
+            linha = sessao.localizar_linha(plano.eh_cabecalho, limite=plano.cabecalho_linhas) if plano.cabecalho else None
+        except Exception as e:
+            raise Exception(plano.spec.get("erro_leitura", "Erro na leitura: {e}").format(e=e))
+        if linha is None and plano.cabecalho and plano.cabecalho_obrigatorio:
+            raise Exception(plano.spec["erro_cabecalho"])
+        try:
+            campos = sessao.linha(linha or 0)
+            if self.esquemas is not None and plano.colunas and campos is not None:
+                usecols = self.esquemas.colunas(plano, linha or 0, campos,
+                                                lambda: sessao.ler(skiprows=linha, nrows=0).columns)
+                if usecols is not None:
+                    try:
+                        return [sessao.ler(skiprows=linha, usecols=usecols)]
+                    except:
+                        pass  # projeção recusada: leitura completa
+            return [sessao.ler(skiprows=linha)]
+        except Exception as e:
+            raise Exception(plano.spec.get("erro_leitura", "Erro na leitura: {e}").format(e=e))
 
+    def _blocos_xlsx_plano(self, plano):
+        """_blocos_plano para xlsx em streaming: cabeçalho nas primeiras linhas da 1ª aba e o resto em blocos."""
+        try:
+            planilha = PlanilhaStreaming(self.file_path)
+        except Exception as e:
+            raise Exception(plano.spec.get("erro_leitura", "Erro na leitura: {e}").format(e=e))
+        try:
+            try:
+                linhas = planilha.linhas(0)
+                inicio = list(itertools.islice(linhas, plano.cabecalho_linhas)) if plano.cabecalho else []
+            except Exception as e:
+                raise Exception(plano.spec.get("erro_leitura", "Erro na leitura: {e}").format(e=e))
+            linha = next((pos for pos, valores in enumerate(inicio) if plano.eh_cabecalho(valores)), None)
+            if linha is None and plano.cabecalho and plano.cabecalho_obrigatorio:
+                raise Exception(plano.spec["erro_cabecalho"])
+            # Sem cabeçalho achado, a 1ª linha é o cabeçalho (header=0)
+            linhas = itertools.chain(inicio[(linha or 0):], linhas)
+            cabecalho = next(linhas, None)
+            if cabecalho is None:
+                yield pd.DataFrame()
+                return
+            usecols = None
+            if self.esquemas is not None and plano.colunas:
+                usecols = self.esquemas.colunas(plano, linha or 0, cabecalho,
+                                                lambda: next(blocos_planilha(iter([]), cabecalho)).columns)
+            yield from blocos_planilha(linhas, cabecalho, usecols)
+        finally:
+            planilha.fechar()
+
+    def _aba_xlsx_mh(self, planilha):
+        """Mesma escolha de aba do ler_arquivo_inteligente, olhando só a 1ª linha (nomes das colunas) de cada uma."""
+        def colunas(aba):
+            return " ".join(str(c).upper() for c in planilha.primeira_linha(aba) or [])
+        if len(planilha.sheet_names) >= 4:
+            try:
+                colunas_str = colunas(3)
+                if "CTRC" in colunas_str or "N.FISCAL" in colunas_str or "NFISCAL" in colunas_str: return 3
+            except:
+                pass
+        for sheet in planilha.sheet_names:
+            colunas_str = colunas(sheet)
+            if "CTRC" in colunas_str and ("N.FISCAL" in colunas_str or "NFISCAL" in colunas_str): return sheet
+        return 0
+
+    def _blocos_xlsx_mh(self, plano):
+        """ler_arquivo_inteligente + busca do cabeçalho para xlsx, em streaming: o cabeçalho é procurado nas
+        primeiras linhas do 1º bloco e vale para os blocos seguintes."""
+        try:
+            planilha = PlanilhaStreaming(self.file_path)
+        except Exception as e:
+            raise Exception(f"Erro Crítico na leitura: {e}")
+        try:
+            try:
+                linhas = planilha.linhas(self._aba_xlsx_mh(planilha))
+                primeira = next(linhas, None)
+            except Exception as e:
+                raise Exception(f"Erro Crítico na leitura: {e}")
+            if primeira is None:
+                yield pd.DataFrame()
+                return
+            blocos = blocos_planilha(linhas, primeira)
+            df = next(blocos)
+            header_idx = plano.localizar_cabecalho(df.values)
+            if header_idx is None:
+                yield df
+                yield from blocos
+                return
+            nomes = list(df.iloc[header_idx])
+            df = df.iloc[header_idx + 1:].reset_index(drop=True)
+            df.columns = nomes
+            yield df
+            yield from renomear_colunas(blocos, nomes)
+        finally:
+            planilha.fechar()
+
+    def _ler_blocos_mh(self, plano):
+        if eh_xlsx(self.file_path): return iniciar_blocos(self._blocos_xlsx_mh(plano))
+        try:
+            self.obter_sessao().sheet_names
+        except:
+            # Não é planilha: CSV em blocos com cabeçalho localizado na amostra
+            try:
+                amostra = AmostraCSV(self.file_path)
+                linha = amostra.localizar_cabecalho(plano.eh_cabecalho, plano.cabecalho_inicio, plano.cabecalho_linhas)
+                return self._ler_csv_projetado(plano, amostra, linha)
+            except:
+                pass
+
+        df = self.ler_arquivo_inteligente()
+
+        # 1. Leitura Robusta: Se falhar ou vier tudo junto, tenta detectar separador (; ou ,) automaticamente
+        if len(df.columns) < 2:
+            try:
+                df = AmostraCSV(self.file_path).ler()
+            except:
+                pass
+
+        # 2. Busca de Cabeçalho (Mantida para compatibilidade)
+        header_idx = plano.localizar_cabecalho(df.values)
+        if header_idx is not None:
+            df.columns = df.iloc[header_idx]
+            df = df.iloc[header_idx + 1:].reset_index(drop=True)
+        return [df]
+
+    def _ler_csv_projetado(self, plano, amostra, skiprows):
+        """Blocos do CSV a partir de `skiprows` só com as colunas do esquema aprendido para este cabeçalho
+        (todas, se não der para projetar)."""
+        cabecalho = amostra.linha_cabecalho(skiprows)
+        if self.esquemas is not None and plano.colunas and cabecalho is not None:
+            numero, campos = cabecalho
+            # Com usecols o read_csv aceita linhas mais largas que o cabeçalho (sem usecols é erro, ou a 1ª
+            # coluna vira índice): só projeta quando nenhuma linha da amostra passa da largura do cabeçalho
+            if all(len(c) <= len(campos) for n, c in amostra.linhas if n > numero):
+                usecols = self.esquemas.colunas(plano, numero, campos,
+                                                lambda: amostra.ler(skiprows=skiprows, nrows=0).columns)
+                if usecols is not None:
+                    try:
+                        return iniciar_blocos(amostra.ler_blocos(skiprows=skiprows, usecols=usecols))
+                    except:
+                        pass  # projeção recusada: leitura completa
+        return iniciar_blocos(amostra.ler_blocos(skiprows=skiprows))
+
+    def _ler_csv_alfa(self, nrows=None, usecols=None):
+        return pd.read_csv(self.file_path, header=None, sep=',', encoding='latin1', engine='python',
+                           nrows=nrows, usecols=usecols)
+
+    def _ler_alfa_projetado(self, plano):
+        """CSV da Alfa num formato já visto: confere o início do arquivo (cabeçalho na mesma linha, com a
+        mesma assinatura) e relê só as colunas do esquema. None quando não é um formato conhecido."""
+        if self.esquemas is None: return None
+        for linha in self.esquemas.linhas_conhecidas(plano):
+            try:
+                inicio = self._ler_csv_alfa(nrows=linha + 1)
+            except:
+                return None
+            if plano.localizar_cabecalho(inicio.values) != linha: continue
+            usecols = self.esquemas.procurar(plano, linha, inicio.values[linha])
+            if usecols is None: continue
+            try:
+                return self._ler_csv_alfa(usecols=usecols)
+            except:
+                return None
+        return None
 
-class LogicApp:
+    def _aprender_esquema_alfa(self, plano, linha):
+        """Guarda o esquema do cabeçalho achado na leitura completa, com os valores lidos como no _ler_alfa_projetado."""
+        if self.esquemas is None: return
+        try:
+            inicio = self._ler_csv_alfa(nrows=linha + 1)
+            nomes = [str(v).strip() for v in inicio.values[linha]]
+        except:
+            return
+        self.esquemas.colunas(plano, linha, inicio.values[linha], lambda: nomes)
+
+    def _blocos_xlsx_alfa(self, plano):
+        """_ler_alfa para xlsx em streaming: o cabeçalho 'Nro.Doc' pode estar em qualquer linha da 1ª aba."""
+        planilha = PlanilhaStreaming(self.file_path)
+        try:
+            linhas = planilha.linhas(0)
+            cabecalho = next((valores for valores in linhas if plano.eh_cabecalho(valores)), None)
+            if cabecalho is None: raise Exception(plano.spec["erro_cabecalho"])
+            # Célula vazia do cabeçalho vira NaN na leitura completa: nome "nan"
+            nomes = ["nan" if v == "" else str(v).strip() for v in cabecalho]
+            yield from renomear_colunas(blocos_planilha(linhas, cabecalho, cabecalho_como_dado=True), nomes)
+        finally:
+            planilha.fechar()
+
+    def _ler_alfa(self, plano):
+        if eh_xlsx(self.file_path): return iniciar_blocos(self._blocos_xlsx_alfa(plano))
+        df = self._ler_alfa_projetado(plano)
+        csv_completo = False
+        if df is None:
+            try:
+                df = self._ler_csv_alfa()
+                csv_completo = True
+            except:
+                df = self.obter_sessao().ler(header=None)
+        cabecalho_idx = plano.localizar_cabecalho(df.values)
+        if cabecalho_idx is None: raise Exception(plano.spec["erro_cabecalho"])
+        if csv_completo: self._aprender_esquema_alfa(plano, cabecalho_idx)
+        df_dados = df.iloc[cabecalho_idx + 1:].copy()
+        df_dados.columns = [str(v).strip() for v in df.iloc[cabecalho_idx].values]
+        return [df_dados]
+
+    def _blocos_txt_excellence(self, plano):
+        return ler_blocos_excellence(self.file_path)
+
+    # --- LEITORES DO CAMINHO LEVE (SEM PANDAS) ---
+    def _blocos_leves_excellence(self, plano):
+        return ler_blocos_excellence(self.file_path, leve=True)
+
+    def _blocos_leves_csv(self, plano):
+        """Mesma leitura do _blocos_plano para CSV sem linha de cabeçalho a procurar (Lista Cargas)."""
+        if plano.cabecalho: raise CaminhoLeveIndisponivel()
+        exigir_texto_leve(self.file_path)
+        try:
+            amostra = AmostraCSV(self.file_path, encoding=plano.encoding)
+        except:
+            raise CaminhoLeveIndisponivel()
+        return plano.processar_leve(ler_csv_leve(self.file_path, amostra.separador, plano.encoding))
+
+    def _blocos_leves_alfa(self, plano):
+        """_ler_alfa sem pandas: o arquivo inteiro em linhas (largura da 1ª) e o cabeçalho 'Nro.Doc' procurado nelas."""
+        exigir_texto_leve(self.file_path)
+        with open(self.file_path, 'r', encoding='latin1', newline='') as f:
+            registros = [campos for campos in csv.reader(f) if not linha_em_branco(campos)]
+        if not registros: raise CaminhoLeveIndisponivel()
+        linhas = list(linhas_leves(registros, len(registros[0])))
+        cabecalho_idx = plano.localizar_cabecalho([["nan" if v is None else v for v in linha] for linha in linhas])
+        if cabecalho_idx is None: raise Exception(plano.spec["erro_cabecalho"])
+        nomes = ["nan" if v is None else v.strip() for v in linhas[cabecalho_idx]]
+        return plano.processar_leve(itertools.chain([nomes], linhas[cabecalho_idx + 1:]))
+
+
+class LogicApp(MotorLimpeza):
     def __init__(self, root):
         self.root = root
         self.root.title("Organizador Logístico Pro v23.16")
@@ -41,15 +2113,19 @@ class LogicApp:
             except Exception as e:
                 print(f"Erro ao carregar ícone: {e}")
 
-        self.libs_carregadas = False
-        self.file_path = None
+        super().__init__()
+        self.perfil = perfil_solicitado()
+        self.contador = ContadorSequencial()
+        self.carga_libs = None  # thread que importa o pandas (só quando um arquivo precisar dele)
+        self.arquivo_aguardando_libs = None
+        self.arquivos = []  # seleção de vários arquivos (vazio = modo de um arquivo só, em self.file_path)
+        self.pool_arquivos = None
         self.df_preview = None
-        self.layout_detectado = None
 
         # --- ESTILOS ---
         style = ttk.Style()
         style.theme_use('clam')
-        style.configure("Treeview", background="white", foreground="black", rowheight=30, fieldbackground="white",
+        style.configure("Treeview", background="white", foreground="black", rowheight=ALTURA_LINHA_PREVIEW, fieldbackground="white",
                         font=("Segoe UI", 10))
         style.configure("Treeview.Heading", font=("Segoe UI", 10, "bold"), background="#DFE6E9", foreground="#2D3436")
         style.map("Treeview", background=[('selected', COLORS['accent_blue'])])
@@ -95,6 +2171,12 @@ class LogicApp:
                                      state="disabled", command=self.processar_dados)
         self.btn_process.pack(side="left", padx=5)
 
+        self.btn_cancel = tk.Button(row2, text="✖ Cancelar", bg=COLORS["accent_red"], fg="white",
+                                    font=("Segoe UI", 10, "bold"), relief="flat", padx=15, pady=5, cursor="hand2",
+                                    state="disabled", command=self.cancelar_processamento)
+        self.btn_cancel.pack(side="left", padx=5)
+        self.cancelar_evento = threading.Event()
+
         self.btn_save_text = tk.StringVar()
         self.btn_save_text.set("💾 3. Salvar (Aguardando arquivo...)")
         self.btn_save = tk.Button(row2, textvariable=self.btn_save_text, bg=COLORS["accent_green"], fg="white",
@@ -107,6 +2189,13 @@ class LogicApp:
                                    command=self.resetar_contador_manual)
         self.btn_reset.pack(side="right")
 
+        self.gravar_base = tk.BooleanVar(value=False)
+        tk.Checkbutton(row2, text="Gravar na base local", variable=self.gravar_base, bg=COLORS["card_bg"],
+                       activebackground=COLORS["card_bg"], font=("Segoe UI", 9), cursor="hand2").pack(side="right", padx=10)
+        self.exportar_delta = tk.BooleanVar(value=False)
+        tk.Checkbutton(row2, text="Só novas/alteradas", variable=self.exportar_delta, bg=COLORS["card_bg"],
+                       activebackground=COLORS["card_bg"], font=("Segoe UI", 9), cursor="hand2").pack(side="right")
+
         # --- TABELA DE PREVIEW ---
         data_frame = tk.Frame(root, bg=COLORS["secondary"])
         data_frame.pack(fill="both", expand=True, padx=20, pady=(0, 20))
@@ -118,154 +2207,140 @@ class LogicApp:
         tree_scroll_x = ttk.Scrollbar(data_frame, orient="horizontal")
         tree_scroll_x.pack(side="bottom", fill="x")
 
-        self.tree = ttk.Treeview(data_frame, columns=("col1"), show="headings", yscrollcommand=tree_scroll_y.set,
+        # Tabela virtual: a Treeview só contém a janela visível (+ buffer) de df_preview;
+        # a barra vertical representa a posição no DataFrame inteiro.
+        self.tree = ttk.Treeview(data_frame, columns=("col1"), show="headings", yscrollcommand=self._ao_rolar_tree,
                                  xscrollcommand=tree_scroll_x.set)
-        tree_scroll_y.config(command=self.tree.yview)
+        self.tree_scroll_y = tree_scroll_y
+        tree_scroll_y.config(command=self._rolar_preview)
         tree_scroll_x.config(command=self.tree.xview)
+        self.preview_inicio = 0
+        # Seleção/foco por número da linha em df_preview (o iid de cada item): sobrevivem à rematerialização
+        self.preview_selecao = set()
+        self.preview_foco = None
 
         self.tree.pack(fill="both", expand=True)
         self.tree.tag_configure('oddrow', background="white")
         self.tree.tag_configure('evenrow', background="#F7F9F9")
+        self.tree.bind("<Configure>", lambda e: self._renderizar_preview())
+        # "break": a rolagem da própria classe Treeview moveria a janela virtual de novo (passo dobrado)
+        self.tree.bind("<MouseWheel>",
+                       lambda e: self._rolar_preview("scroll", -3 if e.delta > 0 else 3, "units") or "break")
+        self.tree.bind("<Button-4>", lambda e: self._rolar_preview("scroll", -3, "units") or "break")
+        self.tree.bind("<Button-5>", lambda e: self._rolar_preview("scroll", 3, "units") or "break")
+        # Seta/PageUp no topo da janela materializada: a Treeview não rola para antes do 1º item
+        self.tree.bind("<Up>", lambda e: self._subir_preview("units"))
+        self.tree.bind("<Prior>", lambda e: self._subir_preview("pages"))
 
         # --- RODAPÉ ---
         status_frame = tk.Frame(root, bg="#BDC3C7", height=25)
         status_frame.pack(fill="x", side="bottom")
-        self.lbl_status = tk.Label(status_frame, text=" Iniciando interface...", bg="#BDC3C7", fg="#2C3E50",
+        self.lbl_status = tk.Label(status_frame, text=" Pronto.", bg="#BDC3C7", fg="#2C3E50",
                                    font=("Segoe UI", 9))
         self.lbl_status.pack(side="left", padx=10)
-
-        # --- THREAD DE CARREGAMENTO ---
-        threading.Thread(target=self.carregar_libs_pesadas, daemon=True).start()
-
-    def carregar_libs_pesadas(self):
-        global pd
+        self.root.protocol("WM_DELETE_WINDOW", self.fechar_janela)
+
+    def fechar_janela(self):
+        # Não espera arquivos ainda em processamento no pool para fechar
+        if self.pool_arquivos is not None: self.pool_arquivos.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
+    # --- CARREGAMENTO SOB DEMANDA ---
+    # O pandas (e o engine de Excel) só é importado quando o arquivo escolhido precisa dele:
+    # planilhas e layouts sem caminho leve. CSV/TXT simples são processados sem esperar.
+    def iniciar_carga_libs(self, path=None):
+        if pd is not None or self.carga_libs is not None: return
+        self.carga_libs = threading.Thread(target=self.carregar_libs_pesadas, args=(path,), daemon=True)
+        self.carga_libs.start()
+
+    def carregar_libs_pesadas(self, path=None):
         try:
             self.root.after(0, lambda: self.lbl_status.config(text=" Carregando núcleo de dados..."))
-            import pandas as pandas_lib  # Importa para variavel local
-            pd = pandas_lib  # Atribui a global
-            self.libs_carregadas = True
-            self.root.after(0, lambda: self.lbl_status.config(text=" Pronto."))
+            carregar_pandas()
+            if path:
+                # Adianta o engine da planilha escolhida (o pd.ExcelFile o importaria ao processar)
+                with open(path, 'rb') as f:
+                    inicio = f.read(8)
+                for assinatura, engine in ENGINES_PLANILHA.items():
+                    if inicio.startswith(assinatura):
+                        try:
+                            __import__(engine)
+                        except ImportError:
+                            pass
+            self.root.after(0, self._libs_prontas)
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Erro", f"Falha libs: {e}"))
-
-    def verificar_libs(self):
-        if not self.libs_carregadas:
-            messagebox.showinfo("Carregando", "O sistema está otimizando a inicialização.\nAguarde...")
-            return False
-        return True
-
-    def ler_arquivo_inteligente(self):
-        try:
-            try:
-                xls = pd.ExcelFile(self.file_path)
-            except:
-                return pd.read_csv(self.file_path, sep=None, encoding='latin1', engine='python')
-            if len(xls.sheet_names) >= 4:
-                try:
-                    df = pd.read_excel(self.file_path, sheet_name=3)
-                    colunas_str = " ".join([str(c).upper() for c in df.columns])
-                    if "CTRC" in colunas_str or "N.FISCAL" in colunas_str or "NFISCAL" in colunas_str: return df
-                except:
-                    pass
-            for sheet in xls.sheet_names:
-                df = pd.read_excel(self.file_path, sheet_name=sheet)
-                colunas_str = " ".join([str(c).upper() for c in df.columns])
-                if "CTRC" in colunas_str and ("N.FISCAL" in colunas_str or "NFISCAL" in colunas_str): return df
-            return pd.read_excel(self.file_path, sheet_name=0)
-        except Exception as e:
-            try:
-                return pd.read_csv(self.file_path, sep=None, encoding='latin1', engine='python')
-            except:
-                raise Exception(f"Erro Crítico na leitura: {e}")
-
-    def identificar_layout(self, path):
-        nome_arq = os.path.basename(path).upper()
-
-        # >>> NOVO: Identificação por nome do arquivo <<<
-        if "LISTA" in nome_arq and "CARGAS" in nome_arq: return "LISTA_CARGAS"
-
-        if "EXCELLENCE" in nome_arq: return "TXT_EXCELLENCE"
-        if "LT" in nome_arq or "DONIZETE" in nome_arq: return "LT"
-        if "AGE" in nome_arq or "MH" in nome_arq: return "AGE"
-        if "ALFA" in nome_arq: return "ALFA"
-        if "TNT" in nome_arq: return "TNT"
-
-        if not self.verificar_libs(): return "AGUARDANDO_LIBS"
-
-        content_upper = ""
-        try:
-            if path.lower().endswith(('.xls', '.xlsx')):
-                try:
-                    xls = pd.ExcelFile(path)
-                    for sheet in xls.sheet_names[:3]:
-                        df_temp = pd.read_excel(xls, sheet_name=sheet, nrows=20, header=None)
-                        content_upper += df_temp.to_string().upper() + " "
-                except:
-                    pass
-
-            if not content_upper:
-                try:
-                    with open(path, 'r', encoding='latin1', errors='ignore') as f:
-                        content_upper = f.read(5000).upper()
-                except:
-                    pass
+            self.carga_libs = None
+            self.root.after(0, lambda e=e: messagebox.showerror("Erro", f"Falha libs: {e}"))
 
-            if not content_upper: return "ERRO_LEITURA"
-
-            if "EXCELLENCE" in content_upper and "NFISCAL" in content_upper: return "TXT_EXCELLENCE"
-            if "NRO.DOC" in content_upper: return "ALFA"
-
-            tem_tnt = "NOTA" in content_upper and ("SERIE" in content_upper or "SÉRIE" in content_upper)
-            if tem_tnt or "FIL. ORIGEM" in content_upper: return "TNT"
-
-            tem_ctrc = "CTRC" in content_upper
-            tem_nf = (
-                    "N.FISCAL" in content_upper or "NFISCAL" in content_upper or "NOTAFISCAL" in content_upper or "NR_NFE" in content_upper)
+    def _libs_prontas(self):
+        self.lbl_status.config(text=" Pronto.")
+        filename, self.arquivo_aguardando_libs = self.arquivo_aguardando_libs, None
+        if filename: self.selecionar_arquivo_retry(filename)
 
-            if "DON" in content_upper and tem_nf: return "LT"
-
-            tem_datas = "PREV" in content_upper and "ENTR" in content_upper
-            if (tem_ctrc and tem_nf) or (tem_datas and tem_nf): return "AGE"
-
-            return "DESCONHECIDO"
-        except Exception as e:
-            print(f"Erro ao identificar: {e}")
-            return "ERRO"
 
     def selecionar_arquivo(self):
-        filename = filedialog.askopenfilename(title="Selecione o arquivo",
-                                              filetypes=[("Arquivos", "*.xls *.xlsx *.csv *.txt"), ("Todos", "*.*")])
+        filenames = list(filedialog.askopenfilenames(title="Selecione o(s) arquivo(s)",
+                                                     filetypes=[("Arquivos", "*.xls *.xlsx *.csv *.txt"), ("Todos", "*.*")]) or [])
+        if len(filenames) > 1:
+            self.selecionar_varios(filenames)
+            return
+        filename = filenames[0] if filenames else None
         if filename:
+            self.arquivos = []
+            self.fechar_sessao()
             self.file_path = filename
             self.lbl_filename.config(text=os.path.basename(filename), fg=COLORS["text_dark"],
                                      font=("Segoe UI", 10, "bold"))
-            self.layout_detectado = self.identificar_layout(self.file_path)
+            self.medidor = MedidorEtapas(filename, perfil=self.perfil)
+            try:
+                planilha = eh_planilha(filename)
+            except OSError:
+                planilha = False
+            if planilha: self.iniciar_carga_libs(filename)
+            with self.medidor.etapa("detectar"):
+                self.layout_detectado = self.identificar_layout(self.file_path)
             if self.layout_detectado == "AGUARDANDO_LIBS":
                 self.lbl_detect_text.config(text="Carregando sistema...", fg="orange")
-                self.root.after(1000, lambda: self.selecionar_arquivo_retry(filename))
+                self.arquivo_aguardando_libs = filename
+                self.iniciar_carga_libs(filename)
                 return
+            # Layout sem caminho leve (ex: TNT, AGE): já vai carregando enquanto o usuário confere a tela
+            if not self.usa_caminho_leve(): self.iniciar_carga_libs()
             self._aplicar_layout_config()
 
+    def selecionar_varios(self, arquivos):
+        """Vários arquivos (transportadoras misturadas): detecção e limpeza de cada um ficam para o pool no Processar."""
+        self.fechar_sessao()
+        self.arquivos = arquivos
+        self.file_path = None
+        self.layout_detectado = None
+        self.medidor = None
+        self.lbl_filename.config(text=f"{len(arquivos)} arquivos selecionados", fg=COLORS["text_dark"],
+                                 font=("Segoe UI", 10, "bold"))
+        self.configurar_status(f"Vários arquivos ({len(arquivos)})", "🗂️", COLORS["primary"])
+        self.btn_process.config(state="normal")
+        self.btn_save.config(state="disabled", bg="#95A5A6")
+        self.iniciar_carga_libs()  # a consolidação no processo principal usa o pandas
+        self.obter_pool(aquecer=len(arquivos))
+
+    def obter_pool(self, aquecer=0):
+        """Pool de processos da seleção múltipla, mantido entre seleções (cada processo importa o pandas uma vez).
+        aquecer: quantos processos já iniciar agora, enquanto o usuário ainda não clicou em Processar."""
+        if self.pool_arquivos is None:
+            self.pool_arquivos = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, initializer=iniciar_processo_vigia)
+        for _ in range(min(aquecer, os.cpu_count() or 1)):
+            self.pool_arquivos.submit(int)
+        return self.pool_arquivos
+
     def selecionar_arquivo_retry(self, filename):
-        if not self.libs_carregadas:
-            self.root.after(1000, lambda: self.selecionar_arquivo_retry(filename))
-            return
+        if filename != self.file_path: return  # outro arquivo foi escolhido enquanto o pandas carregava
         self.layout_detectado = self.identificar_layout(filename)
         self._aplicar_layout_config()
 
     def _aplicar_layout_config(self):
-        if self.layout_detectado == "ALFA":
-            self.configurar_status("Alfa Transportes", "🚛", COLORS["accent_blue"])
-        elif self.layout_detectado == "TNT":
-            self.configurar_status("TNT Mercúrio", "📦", COLORS["accent_orange"])
-        elif self.layout_detectado == "LT":
-            self.configurar_status("LT (Donizete)", "📑", COLORS["accent_purple"])
-        elif self.layout_detectado == "AGE":
-            self.configurar_status("AGE / MH Logística", "📝", "#04b0e4")
-        elif self.layout_detectado == "TXT_EXCELLENCE":
-            self.configurar_status("Excellence (Texto)", "📄", "#2C3E50")
-        elif self.layout_detectado == "LISTA_CARGAS":  # >>> NOVO STATUS
-            self.configurar_status("Lista de Cargas", "📋", COLORS["accent_teal"])
+        spec = ESPECIFICACOES_LAYOUT.get(self.layout_detectado)
+        if spec:
+            self.configurar_status(spec["rotulo"], spec["icone"], spec["cor"])
         else:
             self.lbl_detect_text.config(text=f"Desconhecido ({self.layout_detectado})", fg="red")
             self.lbl_detect_icon.config(text="❌", fg="red")
@@ -281,40 +2356,148 @@ class LogicApp:
         self.btn_process.config(bg=cor)
 
     def processar_dados(self):
-        if not self.verificar_libs(): return
+        self.cancelar_evento.clear()
+        self.btn_process.config(state="disabled")
+        self.btn_select.config(state="disabled")
+        self.btn_cancel.config(state="normal")
+        if self.arquivos:
+            self.lbl_status.config(text=f"Processando {len(self.arquivos)} arquivos...")
+            self.medidor = MedidorEtapas(None, "CONSOLIDADO", perfil=self.perfil)
+            threading.Thread(target=self._processar_varios_em_segundo_plano, args=(list(self.arquivos),),
+                             daemon=True).start()
+            return
         self.lbl_status.config(text=f"Processando {self.layout_detectado}...")
-        self.root.update_idletasks()
+        # Uma medição por processamento; a detecção feita na seleção do arquivo entra no mesmo registro
+        anterior = self.medidor
+        self.medidor = MedidorEtapas(self.file_path, self.layout_detectado, perfil=self.perfil)
+        if anterior is not None and anterior.arquivo == self.file_path and "detectar" in anterior.etapas:
+            self.medidor.etapas["detectar"] = anterior.etapas.pop("detectar")
+        threading.Thread(target=self._processar_em_segundo_plano, args=(self.layout_detectado,), daemon=True).start()
+
+    def cancelar_processamento(self):
+        self.cancelar_evento.set()
+        self.btn_cancel.config(state="disabled")
+        self.lbl_status.config(text="Cancelando...")
+
+    def _status_async(self, texto):
+        self.root.after(0, lambda: self.lbl_status.config(text=texto))
+
+    def _processar_em_segundo_plano(self, layout):
+        """Roda a leitura/limpeza fora da thread do Tk; o cancelamento é checado entre os blocos."""
         try:
-            df_limpo = None
+            try:
+                df_limpo = self._limpar_com_progresso(layout)
+            except CaminhoLeveIndisponivel:
+                # O arquivo foge do que o caminho leve reproduz: refaz do início com o pandas
+                self._status_async(" Carregando núcleo de dados...")
+                carregar_pandas()
+                df_limpo = self._limpar_com_progresso(layout)
+            self.root.after(0, lambda: self._concluir_processamento(df_limpo))
+        except ProcessamentoCancelado:
+            self.root.after(0, self._processamento_cancelado)
+        except Exception as ex:
+            self.root.after(0, lambda ex=ex: self._falha_processamento(ex))
 
-            if self.layout_detectado == "ALFA":
-                df_limpo = self._limpar_alfa()
-            elif self.layout_detectado == "TNT":
-                df_limpo = self._limpar_tnt_smart()
-            elif self.layout_detectado in ["LT", "AGE", "MH"]:
-                df_limpo = self._limpar_mh_smart()
-            elif self.layout_detectado == "TXT_EXCELLENCE":
-                df_limpo = self._limpar_txt_excellence()
-            elif self.layout_detectado == "LISTA_CARGAS":  # >>> NOVA CHAMADA
-                df_limpo = self._limpar_lista_cargas()
+    def _processar_varios_em_segundo_plano(self, arquivos):
+        """Cada arquivo é detectado e limpo num processo do pool; aqui só se junta o que voltou, na ordem da seleção."""
+        try:
+            resultados = {}
+            with self.medidor.etapa("limpar") as info:
+                pendentes = {self.obter_pool().submit(limpar_arquivo_consolidado, arq, True, self.perfil) for arq in arquivos}
+                try:
+                    while pendentes:
+                        if self.cancelar_evento.is_set(): raise ProcessamentoCancelado()
+                        prontos, pendentes = wait(pendentes, timeout=0.2, return_when=FIRST_COMPLETED)
+                        for futuro in prontos:
+                            r = futuro.result()
+                            registrar_desempenho(r["desempenho"])
+                            resultados[r["arquivo"]] = r
+                        if prontos: self._status_async(f"Processando... {len(resultados)}/{len(arquivos)} arquivos")
+                finally:
+                    for futuro in pendentes: futuro.cancel()
+                info["linhas"] = sum(r["linhas"] for r in resultados.values())
+            self._status_async("Montando pré-visualização...")
+            carregar_pandas()
+            with self.medidor.etapa("juntar"):
+                df_limpo = consolidar_resultados(resultados[arq] for arq in arquivos)
+            falhas = [resultados[arq] for arq in arquivos if resultados[arq]["erro"]]
+            self.root.after(0, lambda: self._concluir_processamento(df_limpo, falhas))
+        except ProcessamentoCancelado:
+            self.root.after(0, self._processamento_cancelado)
+        except Exception as ex:
+            self.root.after(0, lambda ex=ex: self._falha_processamento(ex))
 
+    def _limpar_com_progresso(self, layout):
+        if pd is None and not self.usa_caminho_leve(layout):
+            self._status_async(" Carregando núcleo de dados...")
+        else:
+            self._status_async(f"Lendo arquivo ({layout})...")
+        with self.medidor.etapa("cache"):
+            df_limpo = self.resultado_em_cache(layout)
+            if df_limpo is not None: df_limpo = juntar_compactos(df_limpo)
+        if self.cancelar_evento.is_set(): raise ProcessamentoCancelado()
+        blocos = self.limpar_em_blocos(layout) if df_limpo is None else None
+        if blocos is not None:
+            blocos = self.medidor.medindo(self.guardando_em_cache(blocos), "cache")
+            partes = []
+            linhas = 0
+            for bloco in blocos:
+                if self.cancelar_evento.is_set(): raise ProcessamentoCancelado()
+                partes.append(bloco)
+                linhas += len(bloco)
+                self._status_async(f"Processando {layout}... {linhas} linhas limpas")
+            if self.cancelar_evento.is_set(): raise ProcessamentoCancelado()
+            self._status_async("Montando pré-visualização...")
+            with self.medidor.etapa("juntar"):
+                df_limpo = juntar_blocos(partes)
+        return df_limpo
+
+    def _liberar_botoes_processamento(self):
+        self.btn_cancel.config(state="disabled")
+        self.btn_select.config(state="normal")
+        self.btn_process.config(state="normal")
+
+    def _concluir_processamento(self, df_limpo, falhas=()):
+        self._liberar_botoes_processamento()
+        # Seleção múltipla: os arquivos que falharam ficam de fora e são listados no aviso final
+        erros = "".join(f"\n- {os.path.basename(r['arquivo'])}: {r['erro']}" for r in falhas[:10])
+        if erros: erros = "\n\nArquivos com erro:" + erros + ("\n..." if len(falhas) > 10 else "")
+        try:
             if df_limpo is not None and not df_limpo.empty:
+                df_limpo = compactar_resultado(df_limpo)
                 df_limpo.reset_index(drop=True, inplace=True)
                 df_limpo.insert(0, "ITEM", range(1, len(df_limpo) + 1))
                 self.df_preview = df_limpo
-                self.atualizar_tabela(df_limpo)
+                with self.medidor.etapa("pré-visualização"):
+                    self.atualizar_tabela(df_limpo)
 
                 self.btn_save_text.set(self.get_texto_botao_salvar())
 
                 self.btn_save.config(state="normal", bg=COLORS["accent_green"])
-                self.lbl_status.config(text=f"Sucesso! {len(df_limpo)} linhas prontas.")
-                messagebox.showinfo("Processado", f"{len(df_limpo)} linhas extraídas com sucesso.")
+                self.lbl_status.config(text=f"Sucesso! {len(df_limpo)} linhas prontas. ({self._registrar_medicao()})")
+                messagebox.showinfo("Processado", f"{len(df_limpo)} linhas extraídas com sucesso.{erros}")
             else:
-                self.lbl_status.config(text="Vazio.")
-                messagebox.showwarning("Aviso", "Nenhum dado válido encontrado.")
+                self.lbl_status.config(text=f"Vazio. ({self._registrar_medicao()})")
+                messagebox.showwarning("Aviso", f"Nenhum dado válido encontrado.{erros}")
         except Exception as ex:
-            self.lbl_status.config(text="Erro.")
-            messagebox.showerror("Erro Detalhado", f"Ocorreu um erro no processamento:\n{str(ex)}")
+            self._falha_processamento(ex)
+
+    def _registrar_medicao(self, medidor=None):
+        """Grava o perfil (se ligado) e o registro no log de desempenho; devolve o resumo para o lbl_status."""
+        medidor = medidor or self.medidor
+        if medidor is None: return ""
+        medidor.gravar_perfil()
+        registrar_desempenho(medidor.registro())
+        return medidor.resumo()
+
+    def _processamento_cancelado(self):
+        self._liberar_botoes_processamento()
+        self.lbl_status.config(text="Processamento cancelado.")
+
+    def _falha_processamento(self, ex):
+        self._liberar_botoes_processamento()
+        self.lbl_status.config(text="Erro.")
+        messagebox.showerror("Erro Detalhado", f"Ocorreu um erro no processamento:\n{str(ex)}")
 
     def atualizar_tabela(self, df):
         self.tree.delete(*self.tree.get_children())
@@ -330,271 +2513,86 @@ class LogicApp:
                 self.tree.column(col, width=150, minwidth=100, stretch=True, anchor="center")
             else:
                 self.tree.column(col, width=180, minwidth=120, stretch=True, anchor="center")
-        for i, row in enumerate(df.iterrows()):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            self.tree.insert("", "end", values=list(row[1]), tags=(tag,))
+        self.df_preview = df
+        self.preview_inicio = 0
+        self.preview_selecao = set()
+        self.preview_foco = None
+        self._renderizar_preview()
         self.lbl_status.config(text=f" Visualizando {len(df)} linhas.")
 
-    def fmt_dt(self, val):
-        if pd.isna(val) or str(val).strip() == '': return ""
-        try:
-            # Tenta múltiplos formatos comuns em sistemas brasileiros
-            s = str(val).strip()
-            # Remove horas se estiver no formato Excel 'YYYY-MM-DD HH:MM:SS'
-            if " " in s: s = s.split(" ")[0]
-
-            for fmt in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%Y/%m/%d"):
-                try:
-                    dt = datetime.strptime(s, fmt)
-                    return dt.strftime("%d/%m/%Y 00:00")
-                except:
-                    continue
-            return ""
-        except:
-            return ""
-
-    # >>> NOVA FUNÇÃO DE LIMPEZA PARA O SEU ARQUIVO <<<
-    def _limpar_lista_cargas(self):
-        try:
-            # Tenta ler como CSV flexível (detecta separador automaticamente)
-            df = pd.read_csv(self.file_path, sep=None, engine='python', encoding='latin1')
-        except:
-            # Se falhar, tenta ler como Excel padrão
-            try:
-                df = pd.read_excel(self.file_path)
-            except Exception as e:
-                raise Exception(f"Não foi possível ler o arquivo Lista Cargas: {e}")
-
-        # Padroniza nomes das colunas (tudo maiúsculo e sem espaços nas pontas)
-        df.columns = [str(c).upper().strip() for c in df.columns]
-
-        # Identifica colunas chaves baseadas em palavras comuns
-        col_nota = next((c for c in df.columns if any(x in c for x in ['NOTA', 'NF', 'DOCUMENTO', 'NR_NOTA'])), None)
-        col_prev = next((c for c in df.columns if 'PREV' in c), None)
-        # Pega coluna de entrega que NÃO seja a previsão
-        col_ent = next((c for c in df.columns if 'ENTREGA' in c and 'PREV' not in c), None)
-
-        if not col_ent:  # Tenta procurar por DATA_REALIZADA ou BAIXA se não achar ENTREGA
-            col_ent = next((c for c in df.columns if any(x in c for x in ['REALIZ', 'BAIXA'])), None)
-
-        if not col_nota:
-            raise Exception("Não encontrei a coluna de Nota Fiscal/Documento no arquivo.")
-
-        df_final = pd.DataFrame()
-
-        def clean_nf_generic(val):
-            s = str(val).strip()
-            if not s or s.lower() == 'nan': return ""
-            if s.endswith('.0'): s = s[:-2]
-            # Remove tudo que não for dígito
-            s_numeros = re.sub(r'\D', '', s)
-            if s_numeros:
-                return s_numeros.zfill(6)[-6:]  # Pega os ultimos 6 digitos
-            return ""
-
-        # Extração
-        df_final["Nr. Doc."] = df[col_nota].apply(clean_nf_generic)
-
-        if col_prev:
-            df_final["Data de Previsão de Entrega"] = df[col_prev].apply(self.fmt_dt)
-        else:
-            df_final["Data de Previsão de Entrega"] = ""
-
-        if col_ent:
-            df_final["Data Entrega"] = df[col_ent].apply(self.fmt_dt)
+    def _linhas_visiveis_preview(self):
+        """Linhas inteiras abaixo do cabeçalho das colunas (o topo do 1º item dá a altura dele)."""
+        itens = self.tree.get_children()
+        caixa = self.tree.bbox(itens[0]) if itens else ""
+        topo = caixa[1] if caixa else ALTURA_LINHA_PREVIEW
+        return max(1, (self.tree.winfo_height() - topo) // ALTURA_LINHA_PREVIEW)
+
+    def _guardar_selecao_preview(self):
+        """Passa a seleção/foco da janela materializada para preview_selecao/preview_foco."""
+        itens = self.tree.get_children()
+        if not itens: return
+        primeira, ultima = int(itens[0]), int(itens[-1])
+        self.preview_selecao = {i for i in self.preview_selecao if not primeira <= i <= ultima}
+        self.preview_selecao.update(int(iid) for iid in self.tree.selection())
+        foco = self.tree.focus()
+        if foco: self.preview_foco = int(foco)
+
+    def _renderizar_preview(self):
+        """Materializa na Treeview só as linhas da janela atual de df_preview (custo constante)."""
+        self._guardar_selecao_preview()
+        self.tree.delete(*self.tree.get_children())
+        df = self.df_preview
+        if df is None or df.empty:
+            self.tree_scroll_y.set(0, 1)
+            return
+        total = len(df)
+        visiveis = self._linhas_visiveis_preview()
+        self.preview_inicio = max(0, min(self.preview_inicio, total - visiveis))
+        fim = min(total, self.preview_inicio + visiveis + BUFFER_PREVIEW)
+        linhas = zip(*colunas_exportacao(df.iloc[self.preview_inicio:fim], com_item=True))
+        for i, row in enumerate(linhas, start=self.preview_inicio):
+            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
+            self.tree.insert("", "end", iid=str(i), values=list(row), tags=(tag,))
+        self.tree.selection_set([str(i) for i in self.preview_selecao if self.preview_inicio <= i < fim])
+        if self.preview_foco is not None and self.preview_inicio <= self.preview_foco < fim:
+            self.tree.focus(str(self.preview_foco))
+        self.tree.yview_moveto(0)
+        self.tree_scroll_y.set(self.preview_inicio / total, min(1.0, (self.preview_inicio + visiveis) / total))
+
+    def _rolar_preview(self, acao, valor, unidade=None):
+        if self.df_preview is None: return
+        total = len(self.df_preview)
+        visiveis = self._linhas_visiveis_preview()
+        if acao == "moveto":
+            novo = int(float(valor) * total)
         else:
-            df_final["Data Entrega"] = ""
-
-        # Filtros de validade
-        df_final = df_final[df_final["Nr. Doc."].astype(bool)]  # Remove vazios
-        df_final = df_final[df_final["Nr. Doc."] != "000000"]
-
-        return df_final[["Nr. Doc.", "Data de Previsão de Entrega", "Data Entrega"]]
-
-    def _limpar_mh_smart(self):
-        df = self.ler_arquivo_inteligente()
-
-        # 1. Leitura Robusta: Se falhar ou vier tudo junto, tenta detectar separador (; ou ,) automaticamente
-        if len(df.columns) < 2:
-            try:
-                df = pd.read_csv(self.file_path, sep=None, encoding='latin1', engine='python')
-            except:
-                pass
-
-        # 2. Busca de Cabeçalho (Mantida para compatibilidade)
-        header_idx = None
-        for i, row in df.head(30).iterrows():
-            row_str = " ".join([str(val).upper() for val in row.values])
-            keywords_nf = ["N.FISCAL", "NFISCAL", "NOTA FISCAL", "NR.NOTA", "N. NOTA", "NR_NFE", "NR_NFE"]
-            if any(k in row_str for k in keywords_nf):
-                header_idx = i
-                break
-
-        if header_idx is not None:
-            df.columns = df.iloc[header_idx]
-            df = df.iloc[header_idx + 1:].reset_index(drop=True)
-
-        df.columns = df.columns.astype(str).str.upper().str.strip()
-
-        # 3. Identificação de Colunas
-        col_nf = next(
-            (c for c in df.columns if "N.FISCAL" in c or "NFISCAL" in c or "NOTA" in c or "DOC" in c or "NFE" in c),
-            None)
-        col_prev = next((c for c in df.columns if "PREV" in c), None)
-        col_data = next((c for c in df.columns if "ENTREGA" in c and "PREV" not in c), None)
-
-        if not col_data:
-            col_data = next((c for c in df.columns if "DATA" in c and ("BAIXA" in c or "REALIZ" in c)), None)
-
-        if not col_nf:
-            cols_encontradas = ", ".join(list(df.columns))
-            raise Exception(f"Coluna de Nota Fiscal não encontrada.\nColunas no arquivo: [{cols_encontradas}]")
-
-        df_final = pd.DataFrame()
-
-        def clean_nf(val):
-            s = str(val).strip()
-            if not s or s.lower() == 'nan': return ""
-            if s.endswith('.0'): s = s[:-2]
-            s_numeros = re.sub(r'\D', '', s)
-            if s_numeros:
-                return s_numeros.zfill(6)[-6:]
-            return ""
-
-        # 4. NOVA FUNÇÃO DE DATA: Suporta ano com 2 dígitos (ex: 27/11/25 -> 27/11/2025)
-        def local_fmt_dt(val):
-            if pd.isna(val) or str(val).strip() == '': return ""
-            try:
-                # O pandas é mais inteligente para detectar formatos variados
-                dt = pd.to_datetime(val, dayfirst=True, errors='coerce')
-                if pd.notna(dt):
-                    return dt.strftime("%d/%m/%Y 00:00")
-                return ""
-            except:
-                return ""
-
-        df_final["Nr. Doc."] = df[col_nf].apply(clean_nf)
-
-        # Usa a nova função local_fmt_dt
-        df_final["Data de Previsão de Entrega"] = df[col_prev].apply(local_fmt_dt) if col_prev else ""
-        df_final["Data Entrega"] = df[col_data].apply(local_fmt_dt) if col_data else ""
-
-        df_final = df_final[df_final["Nr. Doc."].astype(bool)]
-        df_final = df_final[df_final["Nr. Doc."] != "000000"]
-        return df_final[["Nr. Doc.", "Data de Previsão de Entrega", "Data Entrega"]]
-
-    def _limpar_tnt_smart(self):
-        try:
-            try:
-                df_raw = pd.read_csv(self.file_path, sep=None, engine='python', header=None, nrows=20)
-            except:
-                df_raw = pd.read_excel(self.file_path, header=None, nrows=20)
-        except Exception as e:
-            raise Exception(f"Erro ao ler TNT: {e}")
-        header_row_idx = None
-        for idx, row in df_raw.iterrows():
-            row_str = " ".join([str(val).upper() for val in row.values])
-            if "NOTA" in row_str and ("SERIE" in row_str or "SÉRIE" in row_str):
-                header_row_idx = idx
-                break
-        if header_row_idx is None:
-            raise Exception("Não encontrei a linha de cabeçalho 'NOTA/SERIE'.")
-        try:
-            try:
-                df = pd.read_csv(self.file_path, sep=None, engine='python', skiprows=header_row_idx)
-            except:
-                df = pd.read_excel(self.file_path, skiprows=header_row_idx)
-        except:
-            raise Exception("Erro ao recarregar TNT.")
-        df.columns = df.columns.str.strip().str.upper()
-        col_nota = next((c for c in df.columns if "NOTA" in c and ("SERIE" in c or "SÉRIE" in c)), None)
-        if not col_nota:
-            raise Exception(f"Coluna NOTA/SERIE não encontrada.")
-        df_final = pd.DataFrame()
-
-        def clean(val):
-            s = str(val).strip()
-            if not s or s.lower() == 'nan': return ""
-            if s.endswith('.0'): s = s[:-2]
-            s = s.split('-')[0].strip()
-            s_numeros = re.sub(r'\D', '', s)
-            if s_numeros: return s_numeros.zfill(6)
-            return s
-
-        df_final["Nr. Doc."] = df[col_nota].apply(clean)
-        col_ent = next((c for c in df.columns if "DATA" in c and "FINALIZA" in c), None)
-        col_prev = next((c for c in df.columns if "PREVIS" in c), None)
-        df_final["Data Entrega"] = df[col_ent].apply(self.fmt_dt) if col_ent else ""
-        df_final["Data de Previsão de Entrega"] = df[col_prev].apply(self.fmt_dt) if col_prev else ""
-        df_final = df_final[df_final["Nr. Doc."].astype(bool)]
-        return df_final[["Nr. Doc.", "Data de Previsão de Entrega", "Data Entrega"]].fillna("")
-
-    def _limpar_txt_excellence(self):
-        with open(self.file_path, 'r', encoding='latin1') as f:
-            lines = f.readlines()
-        dados = [];
-        ano_atual = datetime.now().year
-        for linha in lines:
-            if "NFISCAL" in linha or "EXCELLENCE" in linha: continue
-            match = re.search(r'\s+(\d{4,9})\s+.*(\d{2}/\d{2})\s+(\d{2}/\d{2})', linha)
-            if match:
-                nota, prev, ent = match.groups();
-                nota_final = nota.zfill(6)[-6:]
-                try:
-                    dt_prev = datetime.strptime(f"{prev}/{ano_atual}", "%d/%m/%Y").strftime("%d/%m/%Y 00:00")
-                    dt_ent = datetime.strptime(f"{ent}/{ano_atual}", "%d/%m/%Y").strftime("%d/%m/%Y 00:00")
-                    dados.append([nota_final, dt_prev, dt_ent])
-                except:
-                    continue
-        return pd.DataFrame(dados, columns=["Nr. Doc.", "Data de Previsão de Entrega", "Data Entrega"])
-
-    def _limpar_alfa(self):
-        try:
-            df = pd.read_csv(self.file_path, header=None, sep=',', encoding='latin1', engine='python')
-        except:
-            df = pd.read_excel(self.file_path, header=None)
-        cabecalho_idx = None;
-        colunas_map = {};
-        colunas_busca = {"Nro.Doc": "Nro.Doc", "Dt.Emtrega": "Dt.Emtrega"}
-        for idx, row in df.iterrows():
-            row_str = [str(v).strip() for v in row.values]
-            if "Nro.Doc" in row_str:
-                cabecalho_idx = idx
-                for k, v in colunas_busca.items():
-                    if k in row_str: colunas_map[v] = row_str.index(k)
-                break
-        if cabecalho_idx is None: raise Exception("Layout ALFA inválido.")
-        df_dados = df.iloc[cabecalho_idx + 1:].copy();
-        df_final = pd.DataFrame()
-        if "Nro.Doc" in colunas_map: df_final["Nr. Doc."] = df_dados.iloc[:, colunas_map["Nro.Doc"]]
-        if "Dt.Emtrega" in colunas_map: df_final["Data Entrega"] = df_dados.iloc[:, colunas_map["Dt.Emtrega"]]
-        df_final = df_final[df_final["Nr. Doc."].notna()]
-        df_final = df_final[~df_final["Nr. Doc."].astype(str).str.contains("Nro.Doc")]
-
-        def clean(val):
-            s = str(val).strip();
-            return s[:-2] if s.endswith('.0') else s
-
-        df_final["Nr. Doc."] = df_final["Nr. Doc."].apply(
-            lambda x: clean(x).zfill(6) if clean(x).isdigit() else clean(x))
-        df_final["Data de Previsão de Entrega"] = df_final["Data Entrega"].apply(self.fmt_dt)
-        df_final["Data Entrega"] = df_final["Data Entrega"].apply(self.fmt_dt)
-        return df_final[["Nr. Doc.", "Data de Previsão de Entrega", "Data Entrega"]]
-
-    def get_proximo_numero(self):
-        try:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, "r") as f: return int(f.read().strip()) + 1
-            return 1
-        except:
-            return 1
-
-    def salvar_numero_atual(self, numero):
-        try:
-            with open(CONFIG_FILE, "w") as f:
-                f.write(str(numero))
-        except:
-            pass
+            passo = visiveis if unidade == "pages" else 1
+            novo = self.preview_inicio + int(valor) * passo
+        novo = max(0, min(novo, total - visiveis))
+        if novo != self.preview_inicio:
+            self.preview_inicio = novo
+            self._renderizar_preview()
+
+    def _subir_preview(self, unidade):
+        """Seta para cima no 1º item, ou PageUp com a Treeview no topo: recua a janela virtual. Na seta, a linha
+        anterior passa a existir e a própria Treeview move foco e seleção para ela. Fora do topo, nada muda."""
+        itens = self.tree.get_children()
+        if not itens or self.preview_inicio == 0: return None
+        if unidade == "units":
+            if self.tree.focus() != itens[0]: return None
+            self._rolar_preview("scroll", -1, "units")
+            return None
+        if self.tree.yview()[0] > 0: return None
+        self._rolar_preview("scroll", -1, "pages")
+        return "break"
+
+    def _ao_rolar_tree(self, primeiro, ultimo):
+        # Rolagem interna da Treeview (ex: setas do teclado entrando no buffer): desloca a janela virtual
+        itens = self.tree.get_children()
+        deslocamento = int(round(float(primeiro) * len(itens)))
+        if deslocamento > 0 and self.df_preview is not None:
+            self.preview_inicio += deslocamento
+            self.root.after_idle(self._renderizar_preview)
 
     def get_texto_botao_salvar(self):
         agora = datetime.now().strftime("%d-%m-%Y_%Hh%M")
@@ -611,35 +2609,45 @@ class LogicApp:
 
     def salvar_sequencial(self):
         if self.df_preview is None: return
-        numero = self.get_proximo_numero()
-
-        agora = datetime.now().strftime("%d-%m-%Y_%Hh%M")
-
-        if self.file_path:
-            nome_original = os.path.splitext(os.path.basename(self.file_path))[0]
-            nome_limpo = re.sub(r'[^\w\-]', '_', nome_original)
-            if len(nome_limpo) > 40: nome_limpo = nome_limpo[:40]
-            nome_arq = f"Logistica_{nome_limpo}_{agora}.csv"
-        else:
-            nome_arq = f"Logistica_Geral_{agora}.csv"
+        nome_arq = gerar_nome_saida(self.file_path)  # seleção múltipla (sem file_path): Logistica_Geral_...
 
         pasta = os.path.join(os.path.expanduser("~"), "Downloads")
         caminho = os.path.join(pasta, nome_arq)
+        medidor = MedidorEtapas(self.file_path, self.layout_detectado or "CONSOLIDADO", perfil=self.perfil)
         try:
-            df_para_salvar = self.df_preview.copy()
-            if "ITEM" in df_para_salvar.columns: df_para_salvar = df_para_salvar.drop(columns=["ITEM"])
+            df, indices = self.df_preview, []
+            if self.exportar_delta.get():
+                with medidor.etapa("delta") as info:
+                    df, indices = filtrar_delta(self.df_preview, self.layout_detectado)
+                    info["linhas"] = len(df)
+                if not len(df):
+                    messagebox.showinfo("Aviso", "Nenhuma linha nova ou alterada desde a última exportação.")
+                    return
+            with medidor.etapa("gravar") as info:
+                info["linhas"] = exportar_csv(df[COLUNAS_SAIDA], caminho)  # o ERP lê só as 3 colunas
+            for indice in indices: indice.gravar()
+            if self.gravar_base.get():
+                with medidor.etapa("base local"):
+                    base = BaseEntregas()
+                    try:
+                        if "Transportadora" in self.df_preview.columns:
+                            for (layout, arquivo), parte in self.df_preview.groupby(["Transportadora", "Arquivo"],
+                                                                                    observed=True, sort=False):
+                                base.gravar(parte, layout, arquivo)
+                        else:
+                            base.gravar(self.df_preview, self.layout_detectado, self.file_path)
+                    finally:
+                        base.fechar()
 
-            if "Nr. Doc." in df_para_salvar.columns:
-                df_para_salvar["Nr. Doc."] = df_para_salvar["Nr. Doc."].astype(str)
-
-            df_para_salvar.to_csv(caminho, index=False, sep=';', encoding='utf-8-sig', header=False,
-                                  quoting=csv.QUOTE_ALL)
-
-            self.salvar_numero_atual(numero)
+            try:
+                numero = f" nº {self.contador.reservar()}"
+            except:
+                numero = ""
 
             self.btn_save_text.set(self.get_texto_botao_salvar())
 
-            self.lbl_status.config(text=f"Salvo: {nome_arq}")
+            novidades = f", {len(df)} de {len(self.df_preview)} linhas" if indices else ""
+            self.lbl_status.config(text=f"Salvo{numero}: {nome_arq} ({self._registrar_medicao(medidor)}{novidades})")
             self.reset_tela_pos_salvamento(caminho)
         except Exception as ex:
             messagebox.showerror("Erro", str(ex))
@@ -647,26 +2655,609 @@ class LogicApp:
     def reset_tela_pos_salvamento(self, caminho):
         messagebox.showinfo("Sucesso", f"Salvo em:\n{caminho}")
         self.file_path = None;
+        self.arquivos = []
         self.df_preview = None
+        self.fechar_sessao()
         self.lbl_filename.config(text="Nenhum arquivo", fg="#7F8C8D", font=("Segoe UI", 10, "italic"))
         self.lbl_detect_text.config(text="Aguardando...", fg="#7F8C8D");
         self.lbl_detect_icon.config(text="⚪", fg="#7F8C8D")
         self.btn_process.config(state="disabled", bg="#95A5A6");
         self.btn_save.config(state="disabled", bg="#95A5A6")
-        self.tree.delete(*self.tree.get_children());
+        self._renderizar_preview()
         self.lbl_status.config(text="Pronto.")
 
     def resetar_contador_manual(self):
         if messagebox.askyesno("Reset", "Zerar contador?"):
             try:
-                with open(CONFIG_FILE, "w") as f:
-                    f.write("0")
+                self.contador.definir(0)
                 self.btn_save_text.set(self.get_texto_botao_salvar())
             except:
                 pass
 
 
+# --- MODO LOTE (SEM INTERFACE) ---
+EXTENSOES_SUPORTADAS = ('.xls', '.xlsx', '.csv', '.txt')
+
+
+def coletar_arquivos(entradas):
+    arquivos = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            for nome in sorted(os.listdir(entrada)):
+                caminho = os.path.join(entrada, nome)
+                if os.path.isfile(caminho) and nome.lower().endswith(EXTENSOES_SUPORTADAS):
+                    arquivos.append(caminho)
+        elif os.path.isfile(entrada):
+            arquivos.append(entrada)
+        else:
+            print(f"Ignorado (não encontrado): {entrada}", file=sys.stderr)
+    return arquivos
+
+
+def blocos_do_arquivo(motor, medidor, resultado, layout=None):
+    """Detecta o layout (ou usa o informado) e devolve os blocos limpos (do cache, se houver); None se o layout
+    não tem plano."""
+    with medidor.etapa("detectar"):
+        motor.layout_detectado = layout or motor.identificar_layout(motor.file_path)
+    resultado["layout"] = medidor.layout = motor.layout_detectado
+    with medidor.etapa("cache"):
+        blocos = motor.resultado_em_cache()
+    if blocos is not None:
+        resultado["cache"] = True
+        return medidor.medindo(blocos, "cache")
+    blocos = motor.limpar_em_blocos()
+    return None if blocos is None else medidor.medindo(motor.guardando_em_cache(blocos), "cache")
+
+
+def executar_no_arquivo(path, resultado, tratar, usar_cache=True, perfil=None, layout=None):
+    """Moldura comum dos trabalhos por arquivo (lote, serviço, consolidação da GUI): detecta e limpa o arquivo,
+    entrega os blocos a tratar(motor, medidor, blocos) e completa resultado com erro, tempo e desempenho."""
+    inicio = time.perf_counter()
+    motor = None
+    medidor = MedidorEtapas(path, perfil=perfil)
+    try:
+        carregar_pandas()
+        motor = MotorLimpeza(path)
+        motor.medidor = medidor
+        if not usar_cache: motor.cache_resultados = None
+        blocos = blocos_do_arquivo(motor, medidor, resultado, layout)
+        if blocos is None:
+            resultado["erro"] = f"Layout não suportado ({motor.layout_detectado})"
+        else:
+            tratar(motor, medidor, blocos)
+    except Exception as ex:
+        resultado["erro"] = str(ex)
+    finally:
+        if motor is not None: motor.fechar_sessao()
+    resultado["tempo"] = time.perf_counter() - inicio
+    try:
+        medidor.gravar_perfil()
+    except Exception as ex:
+        print(f"Erro ao gravar perfil: {ex}", file=sys.stderr)
+    resultado["desempenho"] = dict(medidor.registro(), erro=resultado["erro"])
+    return resultado
+
+
+def processar_arquivo_lote(path, pasta_saida, formato="csv", base=None, usar_cache=True, perfil=None, layout=None,
+                           delta=None):
+    """Executado em processo separado: detecta (se o layout não veio informado), limpa e exporta um arquivo.
+    delta ("novas"/"completo", ver IndiceDelta): exporta só as linhas novas/alteradas; resultado["delta"] traz
+    quantas linhas foram avaliadas e, sem nenhuma novidade, não há saída nem erro."""
+    resultado = {"arquivo": path, "layout": None, "linhas": 0, "saida": None, "erro": None, "cache": False,
+                 "delta": None}
+
+    def exportar(motor, medidor, blocos):
+        caminho = os.path.join(pasta_saida, gerar_nome_saida(path, formato))
+        base_entregas = None
+        try:
+            if base:
+                base_entregas = BaseEntregas(base)
+                blocos = medidor.medindo(base_entregas.gravando(blocos, motor.layout_detectado, path), "base local")
+            indice = IndiceDelta(motor.layout_detectado) if delta else None
+            with indice.exclusivo() if indice else contextlib.nullcontext():
+                if indice is not None:
+                    # Depois da base local: ela recebe todas as linhas, a exportação só as novidades
+                    blocos = medidor.medindo(indice.filtrando(blocos, completo=delta == "completo"), "delta")
+                try:
+                    with medidor.etapa("gravar") as info:
+                        linhas = info["linhas"] = exportar_blocos(blocos, caminho, formato)
+                except:
+                    if os.path.exists(caminho): os.remove(caminho)
+                    raise
+                if indice is not None:
+                    resultado["delta"] = indice.marcadas
+                    indice.gravar()
+        finally:
+            if base_entregas is not None: base_entregas.fechar()
+        if linhas:
+            resultado["linhas"] = linhas
+            resultado["saida"] = caminho
+        else:
+            os.remove(caminho)
+            if not resultado["delta"]: resultado["erro"] = "Nenhum dado válido encontrado."
+
+    return executar_no_arquivo(path, resultado, exportar, usar_cache, perfil, layout)
+
+
+def limpar_arquivo_consolidado(path, usar_cache=True, perfil=None):
+    """Executado em processo separado (seleção de vários arquivos na GUI): detecta e limpa um arquivo e devolve
+    o DataFrame limpo em resultado["df"], para o processo principal consolidar."""
+    resultado = {"arquivo": path, "layout": None, "linhas": 0, "df": None, "erro": None, "cache": False}
+
+    def juntar(motor, medidor, blocos):
+        with medidor.etapa("juntar"):
+            df = juntar_blocos(blocos)
+        resultado["linhas"] = len(df)
+        if df.empty:
+            resultado["erro"] = "Nenhum dado válido encontrado."
+        else:
+            resultado["df"] = df
+
+    return executar_no_arquivo(path, resultado, juntar, usar_cache, perfil)
+
+
+def consolidar_resultados(resultados):
+    """Junta os DataFrames de vários arquivos num só, na ordem recebida, com as colunas Transportadora (layout)
+    e Arquivo no fim (só para a prévia, a base local e o delta: a exportação mantém as 3 colunas do ERP); None se
+    nenhum arquivo trouxe linhas."""
+    partes = []
+    for r in resultados:
+        if r["df"] is None: continue
+        # Volta ao texto antes de juntar: um arquivo pode vir compacto do cache e outro não
+        df = pd.DataFrame(dict(zip(COLUNAS_SAIDA, colunas_exportacao(r["df"][COLUNAS_SAIDA]))))
+        df["Transportadora"] = r["layout"]
+        df["Arquivo"] = os.path.basename(r["arquivo"])
+        partes.append(df)
+    if not partes: return None
+    df = pd.concat(partes, ignore_index=True)
+    for nome in ("Transportadora", "Arquivo"):
+        df[nome] = df[nome].astype("category")
+    return df
+
+
+def executar_lote(argv=None):
+    parser = argparse.ArgumentParser(description="Organizador Logístico - processamento em lote sem interface.")
+    parser.add_argument("--batch", nargs="+", required=True, metavar="ARQ_OU_PASTA",
+                        help="Arquivos e/ou pastas com os arquivos das transportadoras.")
+    adicionar_opcoes_processamento(parser)
+    args = parser.parse_args(argv)
+
+    arquivos = coletar_arquivos(args.batch)
+    if not arquivos:
+        print("Nenhum arquivo para processar.", file=sys.stderr)
+        return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    inicio = time.perf_counter()
+    falhas = 0
+    salvos = 0
+    numeros = ""
+    workers = max(1, min(args.workers, len(arquivos)))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futuros = [executor.submit(processar_arquivo_lote, arq, args.out, args.formato, args.base,
+                                   not args.sem_cache, args.perfil, delta=args.delta) for arq in arquivos]
+        for futuro in as_completed(futuros):
+            r = futuro.result()
+            if not imprimir_resultado(r): falhas += 1
+            if r["saida"]: salvos += 1  # no delta, arquivo sem novidades não gera saída nem número
+
+    if salvos:
+        # Um bloco de números para o lote inteiro: os processos não disputam o arquivo do contador
+        primeiro = ContadorSequencial().reservar(salvos)
+        numeros = f", nº {primeiro}" + (f" a {primeiro + salvos - 1}" if salvos > 1 else "")
+    total = time.perf_counter() - inicio
+    sem_novidades = len(arquivos) - falhas - salvos
+    numeros += f", {sem_novidades} sem linhas novas" if sem_novidades else ""
+    print(f"Concluído: {salvos}/{len(arquivos)} arquivos em {total:.2f}s ({workers} processos{numeros}).")
+    return 1 if falhas else 0
+
+
+def adicionar_opcoes_processamento(parser, saida=True):
+    """Opções comuns ao lote, ao vigia e ao serviço (saida=False: o serviço devolve o arquivo na resposta, sem
+    --out)."""
+    if saida:
+        parser.add_argument("--out", default=os.path.join(os.path.expanduser("~"), "Downloads"),
+                            help="Pasta de saída dos CSVs (padrão: ~/Downloads).")
+    parser.add_argument("--formato", choices=list(FORMATOS_SAIDA), default="csv",
+                        help="Formato de saída: csv (padrão), csv.gz ou parquet.")
+    parser.add_argument("--base", nargs="?", const=BASE_ENTREGAS, default=None, metavar="ARQ_DB",
+                        help=f"Grava também na base local de entregas (padrão: {BASE_ENTREGAS}).")
+    parser.add_argument("--sem-cache", action="store_true",
+                        help="Ignora o cache de resultados e reprocessa todos os arquivos.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Número de processos paralelos (padrão: núcleos da máquina).")
+    parser.add_argument("--perfil", choices=MODOS_PERFIL, default=perfil_solicitado([]),
+                        help="Grava um relatório cProfile/tracemalloc da etapa mais lenta de cada arquivo.")
+    parser.add_argument("--delta", nargs="?", const="novas", choices=MODOS_DELTA, default=None,
+                        help="Exporta só as linhas novas/alteradas desde a última exportação da transportadora; "
+                             "'--delta completo' exporta tudo (e registra as linhas no índice).")
+
+
+def imprimir_resultado(r):
+    """Mostra o resultado de um arquivo e o acrescenta ao log de desempenho (gravado só pelo processo principal)."""
+    registrar_desempenho(r["desempenho"])
+    nome = os.path.basename(r["arquivo"])
+    if r["erro"]:
+        print(f"[ERRO] {nome} | layout={r['layout']} | {r['tempo']:.2f}s | {r['erro']}", flush=True)
+        return False
+    origem = " | cache" if r["cache"] else ""
+    novidades = f" de {r['delta']} (delta)" if r.get("delta") is not None else ""
+    print(f"[OK]   {nome} | layout={r['layout']} | linhas={r['linhas']}{novidades} | {r['tempo']:.2f}s{origem}",
+          flush=True)
+    print(f"       {resumir_etapas(r['desempenho']['etapas'])}", flush=True)
+    return True
+
+
+# --- MODO VIGIA (PASTA DE ENTRADA) ---
+INTERVALO_VIGIA = 2.0  # segundos entre varreduras quando não há inotify (ou há arquivo esperando estabilizar)
+ESPERA_ESTAVEL = 3.0  # o arquivo só é processado depois de ficar esse tempo sem mudar de tamanho/data
+VARREDURA_SEGURANCA = 60.0  # com inotify, varre mesmo sem eventos (pastas de rede nem sempre avisam)
+
+
+def listar_entrada(pastas):
+    """{caminho: (tamanho, mtime_ns)} dos arquivos suportados nas pastas (sem subpastas e sem temporários)."""
+    estado = {}
+    for pasta in pastas:
+        try:
+            with os.scandir(pasta) as itens:
+                for item in itens:
+                    if item.name.startswith(("~$", ".")) or not item.name.lower().endswith(EXTENSOES_SUPORTADAS):
+                        continue
+                    try:
+                        if not item.is_file(): continue
+                        info = item.stat()
+                    except OSError:
+                        continue
+                    estado[item.path] = (info.st_size, info.st_mtime_ns)
+        except OSError:
+            pass
+    return estado
+
+
+def iniciar_processo_vigia():
+    """Inicializa cada processo do vigia: o Ctrl+C fica só com o processo principal e o pandas já vem carregado."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    carregar_pandas()
+
+
+class VigiaPastas:
+    """Descobre arquivos novos/alterados nas pastas: inotify via watchdog (se instalado) ou varredura periódica."""
+
+    def __init__(self, pastas, intervalo=INTERVALO_VIGIA, espera=ESPERA_ESTAVEL, incluir_existentes=False):
+        self.pastas = pastas
+        self.intervalo = intervalo
+        self.espera = espera
+        self.enviados = {} if incluir_existentes else listar_entrada(pastas)  # caminho -> assinatura já processada
+        self.candidatos = {}  # caminho -> (assinatura, quando foi vista assim pela 1ª vez)
+        self.evento = threading.Event()
+        self.observador = self._iniciar_inotify()
+
+    def _iniciar_inotify(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+        evento = self.evento
+
+        class Aviso(FileSystemEventHandler):
+            def on_any_event(self, ocorrido):
+                evento.set()
+
+        observador = Observer()
+        for pasta in self.pastas:
+            observador.schedule(Aviso(), pasta, recursive=False)
+        observador.start()
+        return observador
+
+    def prontos(self):
+        """Arquivos novos/alterados que já pararam de ser escritos (tamanho e data estáveis por `espera` s)."""
+        agora = time.monotonic()
+        prontos = []
+        estado = listar_entrada(self.pastas)
+        for caminho in list(self.candidatos):
+            if caminho not in estado: del self.candidatos[caminho]
+        for caminho, assinatura in estado.items():
+            if self.enviados.get(caminho) == assinatura: continue
+            anterior = self.candidatos.get(caminho)
+            if anterior is None or anterior[0] != assinatura:
+                self.candidatos[caminho] = (assinatura, agora)
+            elif agora - anterior[1] >= self.espera:
+                del self.candidatos[caminho]
+                self.enviados[caminho] = assinatura
+                prontos.append(caminho)
+        return prontos
+
+    def aguardar(self):
+        espera = VARREDURA_SEGURANCA if self.observador is not None and not self.candidatos else self.intervalo
+        self.evento.wait(espera)
+        self.evento.clear()
+
+    def parar(self):
+        if self.observador is not None:
+            self.observador.stop()
+            self.observador.join()
+
+
+def executar_vigia(argv=None):
+    parser = argparse.ArgumentParser(description="Organizador Logístico - vigia pastas e processa os arquivos que chegam.")
+    parser.add_argument("--watch", nargs="+", required=True, metavar="PASTA", help="Pasta(s) de entrada.")
+    parser.add_argument("--existentes", action="store_true",
+                        help="Processa também os arquivos que já estavam nas pastas ao iniciar.")
+    parser.add_argument("--intervalo", type=float, default=INTERVALO_VIGIA,
+                        help=f"Segundos entre varreduras sem inotify (padrão: {INTERVALO_VIGIA}).")
+    parser.add_argument("--espera", type=float, default=ESPERA_ESTAVEL,
+                        help=f"Segundos sem alteração para considerar o arquivo completo (padrão: {ESPERA_ESTAVEL}).")
+    adicionar_opcoes_processamento(parser)
+    args = parser.parse_args(argv)
+
+    pastas = [p for p in args.watch if os.path.isdir(p)]
+    for p in set(args.watch) - set(pastas):
+        print(f"Ignorada (não é pasta): {p}", file=sys.stderr)
+    if not pastas: return 1
+    os.makedirs(args.out, exist_ok=True)
+
+    vigia = VigiaPastas(pastas, args.intervalo, args.espera, args.existentes)
+    workers = max(1, args.workers)
+    modo = "inotify" if vigia.observador is not None else f"varredura a cada {args.intervalo:g}s"
+    print(f"Vigiando {', '.join(pastas)} ({modo}, {workers} processos). Ctrl+C para sair.")
+
+    fila = deque()
+    pendentes = set()
+    contador = ContadorSequencial()
+    # Processos fixos com o pandas já importado: cada arquivo novo não paga a partida do interpretador
+    with ProcessPoolExecutor(max_workers=workers, initializer=iniciar_processo_vigia) as executor:
+        try:
+            while True:
+                fila.extend(vigia.prontos())
+                while fila and len(pendentes) < workers * 2:
+                    futuro = executor.submit(processar_arquivo_lote, fila.popleft(), args.out, args.formato,
+                                             args.base, not args.sem_cache, args.perfil, delta=args.delta)
+                    futuro.add_done_callback(lambda _: vigia.evento.set())
+                    pendentes.add(futuro)
+                for futuro in [f for f in pendentes if f.done()]:
+                    pendentes.discard(futuro)
+                    r = futuro.result()
+                    if imprimir_resultado(r) and r["saida"]: contador.reservar()
+                vigia.aguardar()
+        except KeyboardInterrupt:
+            print("Encerrando o vigia...")
+        finally:
+            vigia.parar()
+    return 0
+
+
+# --- MODO SERVIÇO (HTTP LOCAL) ---
+# Para os scripts de importação do ERP: o arquivo da transportadora vai no corpo de um POST e o CSV limpo
+# volta na resposta, sem abrir a interface. O serviço fica no ar com processos de limpeza fixos (pandas já
+# importado) e reserva o número sequencial de cada exportação, como o lote e o vigia.
+#   curl --data-binary @TNT_dia.csv "http://127.0.0.1:8765/limpar?nome=TNT_dia.csv&layout=TNT" -o saida.csv
+# "layout" é opcional (sem ele o layout é detectado pelo nome/conteúdo); "delta" troca o --delta do serviço só
+# naquele pedido; GET /status mostra versão e contador.
+PORTA_SERVICO = 8765
+TIPOS_CONTEUDO = {"csv": "text/csv; charset=utf-8", "csv.gz": "application/gzip",
+                  "parquet": "application/vnd.apache.parquet"}
+TAMANHO_MAXIMO_ENVIO = 512 * 1024 * 1024
+TAMANHO_PARTE_ENVIO = 1024 * 1024
+
+
+class ServicoLimpeza(ThreadingHTTPServer):
+    """Uma thread por conexão e um pool fixo de processos de limpeza. Com `limite` pedidos em andamento (padrão:
+    workers * 2) os seguintes recebem 503 (o cliente tenta de novo) em vez de formar uma fila sem limite."""
+    daemon_threads = True
+
+    def __init__(self, endereco, workers, limite=None, usar_cache=True, perfil=None, formato="csv", base=None,
+                 delta=None):
+        super().__init__(endereco, ManipuladorServico)
+        self.workers = workers
+        self.limite = limite or workers * 2
+        self.usar_cache = usar_cache
+        self.perfil = perfil
+        self.formato = formato
+        self.base = base
+        self.delta = delta
+        self.vagas = threading.BoundedSemaphore(self.limite)
+        self.contador = ContadorSequencial()
+        self.trava_log = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=iniciar_processo_vigia)
+        # Sobe os processos agora: o 1º pedido já encontra o pandas carregado
+        for futuro in [self.executor.submit(int) for _ in range(workers)]: futuro.result()
+
+    def limpar(self, caminho, layout=None, delta=None):
+        """Limpa o arquivo num processo do pool e exporta a saída na mesma pasta temporária."""
+        resultado = self.executor.submit(processar_arquivo_lote, caminho, os.path.dirname(caminho), self.formato,
+                                         self.base, self.usar_cache, self.perfil, layout,
+                                         delta or self.delta).result()
+        with self.trava_log:
+            registrar_desempenho(resultado["desempenho"])
+        return resultado
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError): return  # o cliente desistiu no meio: nada a registrar
+        super().handle_error(request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+class ManipuladorServico(BaseHTTPRequestHandler):
+    server_version = "OrganizadorLogistico/" + VERSAO_LIMPEZA
+    protocol_version = "HTTP/1.1"  # conexão reaproveitada entre pedidos (toda resposta leva Content-Length)
+    disable_nagle_algorithm = True  # cabeçalho e corpo saem em escritas separadas: sem isso, +40 ms por resposta
+
+    def responder_json(self, status, dados, cabecalhos=()):
+        corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        for nome, valor in cabecalhos: self.send_header(nome, valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def recusar(self, status, erro, cabecalhos=()):
+        """Responde sem processar. O corpo ainda não lido é descartado (se tiver tamanho aceitável), senão o
+        cliente, que ainda está enviando, recebe a conexão fechada em vez da resposta."""
+        try:
+            restante = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            restante = None
+        if restante is None or not 0 <= restante <= TAMANHO_MAXIMO_ENVIO:
+            self.close_connection = True
+        else:
+            while restante > 0:
+                parte = self.rfile.read(min(restante, TAMANHO_PARTE_ENVIO))
+                if not parte: break
+                restante -= len(parte)
+        self.responder_json(status, {"erro": erro}, cabecalhos)
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/status":
+            return self.responder_json(404, {"erro": "Use POST /limpar ou GET /status."})
+        self.responder_json(200, {"versao": VERSAO_LIMPEZA, "layouts": sorted(PLANOS), "workers": self.server.workers,
+                                  "limite": self.server.limite, "formato": self.server.formato,
+                                  "ultimo_numero": self.server.contador.atual()})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/limpar": return self.recusar(404, "Use POST /limpar ou GET /status.")
+        parametros = {nome: valores[-1] for nome, valores in parse_qs(url.query).items()}
+        layout = parametros.get("layout", "").strip().upper() or None
+        if layout is not None and layout not in PLANOS:
+            return self.recusar(400, f"Layout desconhecido: {layout}. Use um de: {', '.join(sorted(PLANOS))}.")
+        delta = parametros.get("delta", "").strip().lower() or None
+        if delta is not None and delta not in MODOS_DELTA:
+            return self.recusar(400, f"Delta desconhecido: {delta}. Use um de: {', '.join(MODOS_DELTA)}.")
+        nome = os.path.basename(parametros.get("nome") or self.headers.get("X-Arquivo") or "").strip()
+        if not nome or nome.startswith("."): nome = "arquivo.csv"
+        try:
+            tamanho = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self.recusar(411, "Envie o arquivo no corpo do pedido, com Content-Length.")
+        if tamanho < 0: return self.recusar(400, "Content-Length inválido.")
+        if tamanho > TAMANHO_MAXIMO_ENVIO:
+            return self.recusar(413, f"Arquivo acima de {TAMANHO_MAXIMO_ENVIO // (1024 * 1024)} MB.")
+        if not self.server.vagas.acquire(blocking=False):
+            return self.recusar(503, "Serviço ocupado, tente de novo em instantes.", [("Retry-After", "1")])
+        try:
+            with tempfile.TemporaryDirectory(prefix="logistica_") as pasta:
+                caminho = os.path.join(pasta, nome)
+                restante = tamanho
+                with open(caminho, "wb") as f:
+                    while restante:
+                        parte = self.rfile.read(min(restante, TAMANHO_PARTE_ENVIO))
+                        if not parte: break
+                        f.write(parte)
+                        restante -= len(parte)
+                if restante:
+                    self.close_connection = True
+                    return self.responder_json(400, {"erro": "Envio interrompido antes do fim do arquivo."})
+                try:
+                    r = self.server.limpar(caminho, layout, delta)
+                except Exception as ex:
+                    return self.responder_json(500, {"erro": str(ex)})
+                if r["erro"]: return self.responder_json(422, {"erro": r["erro"], "layout": r["layout"]})
+                if not r["saida"]:
+                    # delta sem novidades: resposta vazia e nenhum número consumido
+                    self.send_response(200)
+                    self.send_header("Content-Type", TIPOS_CONTEUDO[self.server.formato])
+                    self.send_header("Content-Length", "0")
+                    self.send_header("X-Layout", r["layout"])
+                    self.send_header("X-Linhas", "0")
+                    self.send_header("X-Delta", str(r["delta"]))
+                    self.end_headers()
+                    return
+                try:
+                    numero = str(self.server.contador.reservar())
+                except:
+                    numero = ""
+                self.send_response(200)
+                self.send_header("Content-Type", TIPOS_CONTEUDO[self.server.formato])
+                self.send_header("Content-Length", str(os.path.getsize(r["saida"])))
+                self.send_header("Content-Disposition", f'attachment; filename="{os.path.basename(r["saida"])}"')
+                self.send_header("X-Layout", r["layout"])
+                self.send_header("X-Linhas", str(r["linhas"]))
+                if r["delta"] is not None: self.send_header("X-Delta", str(r["delta"]))
+                self.send_header("X-Numero", numero)
+                self.end_headers()
+                with open(r["saida"], "rb") as f:
+                    shutil.copyfileobj(f, self.wfile)
+        finally:
+            self.server.vagas.release()
+
+
+def encerrar_por_sinal(sinal, quadro):
+    raise KeyboardInterrupt
+
+
+def executar_servico(argv=None):
+    parser = argparse.ArgumentParser(description="Organizador Logístico - serviço HTTP local de limpeza.")
+    parser.add_argument("--servir", nargs="?", type=int, const=PORTA_SERVICO, required=True, metavar="PORTA",
+                        help=f"Porta do serviço (padrão: {PORTA_SERVICO}).")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Endereço de escuta (padrão: 127.0.0.1, só esta máquina).")
+    parser.add_argument("--limite", type=int, default=None, metavar="N",
+                        help="Pedidos em andamento ao mesmo tempo; acima disso responde 503 (padrão: 2 por worker).")
+    adicionar_opcoes_processamento(parser, saida=False)
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    limite = max(1, args.limite) if args.limite else None
+    try:
+        servico = ServicoLimpeza((args.host, args.servir), workers, limite, not args.sem_cache, args.perfil,
+                                 args.formato, args.base, args.delta)
+    except OSError as ex:
+        print(f"Não foi possível abrir {args.host}:{args.servir}: {ex}", file=sys.stderr)
+        return 1
+    print(f"Servindo em http://{args.host}:{args.servir} ({workers} processos, até {servico.limite} pedidos). "
+          "Ctrl+C para sair.", flush=True)
+    signal.signal(signal.SIGTERM, encerrar_por_sinal)  # parado pelo gerenciador de serviços: fecha o pool também
+    try:
+        servico.serve_forever()
+    except KeyboardInterrupt:
+        print("Encerrando o serviço...")
+    finally:
+        servico.server_close()
+    return 0
+
+
+def executar_consulta(argv=None):
+    parser = argparse.ArgumentParser(description="Organizador Logístico - consulta à base local de entregas.")
+    parser.add_argument("--consultar", nargs="+", required=True, metavar="NR_DOC", help="Número(s) da NF.")
+    parser.add_argument("--transportadora", default=None, help="Filtra por layout (ex.: TNT, AGE, ALFA).")
+    parser.add_argument("--base", default=BASE_ENTREGAS, metavar="ARQ_DB",
+                        help=f"Arquivo da base (padrão: {BASE_ENTREGAS}).")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.base):
+        print(f"Base não encontrada: {args.base}", file=sys.stderr)
+        return 1
+    base = BaseEntregas(args.base)
+    encontrados = 0
+    try:
+        for nr_doc in args.consultar:
+            registros = base.consultar(nr_doc, args.transportadora)
+            if not registros:
+                print(f"{nr_doc} | não encontrado")
+            for r in registros:
+                encontrados += 1
+                print(f"{r['nr_doc']} | {r['transportadora']} | previsão={r['previsao'] or '-'} | "
+                      f"entrega={r['entrega'] or '-'} | {r['arquivo']} ({r['atualizado']})")
+    finally:
+        base.fechar()
+    return 0 if encontrados else 1
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if "--consultar" in sys.argv[1:]:
+        sys.exit(executar_consulta())
+    if "--watch" in sys.argv[1:]:
+        sys.exit(executar_vigia())
+    if "--batch" in sys.argv[1:]:
+        sys.exit(executar_lote())
+    if "--servir" in sys.argv[1:]:
+        sys.exit(executar_servico())
     root = tk.Tk()
     app = LogicApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""Benchmark do Organizador Logístico: gera arquivos sintéticos de cada layout e mede as etapas.
+
+Uso:
+    python benchmark_limpeza.py                          # 10k e 100k linhas, todos os layouts, CSV e xlsx
+    python benchmark_limpeza.py --completo               # 10k, 100k, 1M e 5M linhas
+    python benchmark_limpeza.py --layouts TNT AGE --linhas 500000 --formatos csv
+    python benchmark_limpeza.py --comparar bench_anterior.json
+
+Cada caso roda num processo novo (o pico de memória é do caso, não do acumulado) pelo mesmo fluxo em blocos do
+lote, e mede separadamente detectar -> ler -> limpar -> gravar. O resultado vai para um JSON (padrão:
+bench_limpeza.json).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import Limpeza_read_v17_no_arq_opt as app
+
+LAYOUTS = ("ALFA", "TNT", "AGE", "LT", "TXT_EXCELLENCE", "LISTA_CARGAS")
+LINHAS_PADRAO = (10000, 100000)
+LINHAS_COMPLETO = (10000, 100000, 1000000, 5000000)
+LIMITE_LINHAS_XLSX = 1048576 - 10  # limite de linhas de uma aba do Excel (menos o preâmbulo)
+
+
+# --- GERADORES SINTÉTICOS ---
+# Cada gerador devolve (preâmbulo, cabeçalho, função linha(i)). Os nomes dos arquivos são neutros
+# ("caso_...") para a detecção passar pelo conteúdo; só a Lista de Cargas, que é detectada apenas
+# pelo nome, leva LISTA_CARGAS no nome. Toda linha com NF vazia (i % 97 == 0) é descartada na limpeza e
+# as demais saem: linhas_esperadas() confere a saída (um separador farejado errado zera as linhas sem erro).
+def _nf(rnd, i):
+    if i % 97 == 0: return ""
+    return str(rnd.randint(100, 99999999))
+
+
+def _data(rnd, base, i):
+    if i % 53 == 0: return ""
+    return (base + timedelta(days=rnd.randint(0, 400))).strftime("%d/%m/%Y")
+
+
+def gerador_layout(layout, rnd):
+    base = datetime(2025, 1, 1)
+    if layout == "ALFA":
+        return ([["Alfa Transportes", "", "", ""], ["", "", "", ""]], ["Cliente", "Nro.Doc", "Emissao", "Dt.Emtrega"],
+                lambda i: [f"CLIENTE {i % 500}", _nf(rnd, i), _data(rnd, base, i), _data(rnd, base, i + 1)])
+    if layout == "TNT":
+        # Título solto acima do cabeçalho, como no relatório real: no CSV o separador aparente dele não é o ";"
+        return ([["Relatorio de entregas TNT Mercurio"], ["Relatorio,emitido em 01/02"]],
+                ["FIL. ORIGEM", "NOTA/SERIE", "PREVISAO ENTREGA", "DATA FINALIZACAO"],
+                lambda i: ["SP", f"{_nf(rnd, i)}/{i % 9}" if i % 97 else "", _data(rnd, base, i), _data(rnd, base, i + 1)])
+    if layout == "AGE":
+        return ([], ["CTRC", "N.FISCAL", "PREV. ENTREGA", "DATA ENTREGA"],
+                lambda i: [str(100000 + i), _nf(rnd, i), _data(rnd, base, i), _data(rnd, base, i + 1)])
+    if layout == "LT":
+        return ([["TRANSPORTES DONIZETE", "", "", ""]], ["CTRC", "NR_NFE", "PREVISAO", "DATA BAIXA"],
+                lambda i: [str(100000 + i), _nf(rnd, i), _data(rnd, base, i), _data(rnd, base, i + 1)])
+    if layout == "LISTA_CARGAS":
+        return ([], ["NR_NOTA", "DATA PREVISAO", "DATA ENTREGA", "CLIENTE"],
+                lambda i: [_nf(rnd, i), _data(rnd, base, i), _data(rnd, base, i + 1), f"CLIENTE {i % 500}"])
+    raise ValueError(layout)
+
+
+def linhas_esperadas(layout, linhas):
+    if layout == "TXT_EXCELLENCE": return linhas  # o gerador não deixa NF vazia
+    return linhas - (linhas + 96) // 97
+
+
+def gerar_excellence(caminho, linhas, rnd):
+    with open(caminho, "w", encoding="latin1") as f:
+        f.write("EXCELLENCE TRANSPORTES          RELATORIO DE ENTREGAS\n")
+        f.write("CTRC      NFISCAL     CLIENTE                          PREV    ENTR\n")
+        for i in range(linhas):
+            f.write(f"  {100000 + i:<8}{rnd.randint(1000, 99999999):<12}CLIENTE LTDA {i % 500:<20}"
+                    f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}   {rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}\n")
+
+
+def gerar_arquivo(pasta, layout, formato, linhas, semente=1):
+    rnd = random.Random(semente)
+    prefixo = "LISTA_CARGAS" if layout == "LISTA_CARGAS" else f"caso_{LAYOUTS.index(layout)}"
+    caminho = os.path.join(pasta, f"{prefixo}_{linhas}.{formato}")
+    if layout == "TXT_EXCELLENCE":
+        gerar_excellence(caminho, linhas, rnd)
+        return caminho
+    preambulo, cabecalho, linha = gerador_layout(layout, rnd)
+    separador = "," if layout == "ALFA" else ";"
+    if formato == "csv":
+        with open(caminho, "w", encoding="latin1", newline="") as f:
+            for campos in preambulo + [cabecalho]:
+                f.write(separador.join(campos) + "\n")
+            for i in range(linhas):
+                f.write(separador.join(linha(i)) + "\n")
+    else:
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Relatorio")
+        for campos in preambulo + [cabecalho]:
+            ws.append(campos)
+        for i in range(linhas):
+            ws.append(linha(i))
+        wb.save(caminho)
+    return caminho
+
+
+# --- MEDIÇÃO ---
+def pico_memoria_mb():
+    """Pico de memória residente do processo (None se a plataforma não informa)."""
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def medir_caso(caminho, layout_esperado, pasta_saida):
+    """Roda num processo próprio o mesmo fluxo do lote: limpar_em_blocos consumido pela exportação, com os tempos
+    de detectar/ler/limpar/gravar do MedidorEtapas (cada bloco é lido, limpo e gravado antes do próximo)."""
+    app.carregar_pandas()
+    motor = app.MotorLimpeza(caminho)
+    motor.cache_resultados = None
+    motor.esquemas = None  # sem projeção aprendida: toda rodada mede a leitura completa (e não grava em ~)
+    motor.medidor = medidor = app.MedidorEtapas(caminho)
+    app.CACHE_LAYOUT.clear()
+
+    with medidor.etapa("detectar"):
+        layout = motor.identificar_layout(caminho)
+    if app.PLANOS.get(layout) is None:
+        return {"layout_detectado": layout, "erro": "layout sem plano de extração"}
+    motor.layout_detectado = layout
+
+    saida = os.path.join(pasta_saida, os.path.basename(caminho) + ".out.csv")
+    try:
+        with medidor.etapa("gravar"):
+            linhas_saida = app.exportar_blocos(motor.limpar_em_blocos(layout), saida)
+    finally:
+        motor.fechar_sessao()
+        if os.path.exists(saida): os.remove(saida)
+
+    tempos = {nome: medidor.etapas[nome]["s"] if nome in medidor.etapas else 0.0
+              for nome in ("detectar", "ler", "limpar", "gravar")}
+    total = sum(tempos.values())
+    return {
+        "layout_detectado": layout,
+        "detectou_certo": layout == layout_esperado or (layout_esperado == "LT" and layout in ("LT", "AGE")),
+        "linhas_saida": linhas_saida,
+        "tempos_s": {k: round(v, 4) for k, v in tempos.items()},
+        "total_s": round(total, 4),
+        "pico_rss_mb": pico_memoria_mb(),
+    }
+
+
+def casos(layouts, formatos, tamanhos):
+    for layout in layouts:
+        for formato in formatos:
+            if layout == "TXT_EXCELLENCE" and formato != "txt": continue
+            if layout != "TXT_EXCELLENCE" and formato == "txt": continue
+            for linhas in tamanhos:
+                if formato == "xlsx" and linhas > LIMITE_LINHAS_XLSX: continue
+                yield layout, formato, linhas
+
+
+def executar(args):
+    pasta = args.pasta or tempfile.mkdtemp(prefix="bench_limpeza_")
+    os.makedirs(pasta, exist_ok=True)
+    formatos = list(args.formatos)
+    if "TXT_EXCELLENCE" in args.layouts and "txt" not in formatos: formatos.append("txt")
+
+    resultados = []
+    try:
+        for layout, formato, linhas in casos(args.layouts, formatos, args.linhas):
+            inicio = time.perf_counter()
+            caminho = gerar_arquivo(pasta, layout, formato, linhas)
+            geracao = time.perf_counter() - inicio
+            # Processo novo por caso: pico de memória isolado e nada aproveitado do caso anterior
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                medida = executor.submit(medir_caso, caminho, layout, pasta).result()
+            caso = {"layout": layout, "formato": formato, "linhas": linhas,
+                    "arquivo_mb": round(os.path.getsize(caminho) / (1024 * 1024), 2),
+                    "geracao_s": round(geracao, 2)}
+            caso.update(medida)
+            if "total_s" in caso:
+                caso["linhas_esperadas"] = linhas_esperadas(layout, linhas)
+                caso["linhas_s"] = round(linhas / caso["total_s"]) if caso["total_s"] else None
+            resultados.append(caso)
+            imprimir_caso(caso)
+            if not args.manter: os.remove(caminho)
+    finally:
+        if not args.manter and not args.pasta: shutil.rmtree(pasta, ignore_errors=True)
+    return resultados
+
+
+def imprimir_caso(caso):
+    if "erro" in caso:
+        print(f"{caso['layout']:<15}{caso['formato']:<6}{caso['linhas']:>9}  ERRO: {caso['erro']} "
+              f"(detectado {caso['layout_detectado']})")
+        return
+    t = caso["tempos_s"]
+    aviso = "" if caso["detectou_certo"] else f"  [detectado como {caso['layout_detectado']}]"
+    if caso["linhas_saida"] != caso["linhas_esperadas"]:
+        aviso += f"  [saída com {caso['linhas_saida']} linhas, esperadas {caso['linhas_esperadas']}]"
+    print(f"{caso['layout']:<15}{caso['formato']:<6}{caso['linhas']:>9}  "
+          f"det={t['detectar']:.3f}s ler={t['ler']:.3f}s limpar={t['limpar']:.3f}s gravar={t['gravar']:.3f}s  "
+          f"{caso['linhas_s'] or 0:>10} linhas/s  pico={caso['pico_rss_mb']} MB{aviso}", flush=True)
+
+
+def comparar(resultados, caminho_anterior):
+    """Mostra a variação de linhas/s em relação a um JSON anterior (casos com mesmo layout/formato/linhas)."""
+    with open(caminho_anterior, encoding="utf-8") as f:
+        anterior = {(c["layout"], c["formato"], c["linhas"]): c for c in json.load(f)["casos"]}
+    print(f"\nComparação com {caminho_anterior} (linhas/s; negativo = mais lento):")
+    for caso in resultados:
+        antes = anterior.get((caso["layout"], caso["formato"], caso["linhas"]))
+        if not antes or not antes.get("linhas_s") or not caso.get("linhas_s"): continue
+        variacao = (caso["linhas_s"] / antes["linhas_s"] - 1) * 100
+        print(f"{caso['layout']:<15}{caso['formato']:<6}{caso['linhas']:>9}  {antes['linhas_s']:>10} -> "
+              f"{caso['linhas_s']:>10}  ({variacao:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de detecção/leitura/limpeza/gravação.")
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=list(LAYOUTS))
+    parser.add_argument("--formatos", nargs="+", choices=("csv", "xlsx"), default=["csv", "xlsx"],
+                        help="Formatos das planilhas geradas (o Excellence é sempre .txt).")
+    parser.add_argument("--linhas", nargs="+", type=int, default=list(LINHAS_PADRAO))
+    parser.add_argument("--completo", action="store_true", help="Usa 10k, 100k, 1M e 5M linhas.")
+    parser.add_argument("--saida", default="bench_limpeza.json", help="Arquivo JSON com os resultados.")
+    parser.add_argument("--comparar", metavar="JSON_ANTERIOR", help="Compara com um resultado anterior.")
+    parser.add_argument("--pasta", help="Pasta para os arquivos gerados (padrão: temporária).")
+    parser.add_argument("--manter", action="store_true", help="Não apaga os arquivos gerados.")
+    args = parser.parse_args(argv)
+    if args.completo: args.linhas = list(LINHAS_COMPLETO)
+
+    app.carregar_pandas()
+    resultados = executar(args)
+    relatorio = {
+        "versao_limpeza": app.VERSAO_LIMPEZA,
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": app.pd.__version__,
+        "plataforma": platform.platform(),
+        "casos": resultados,
+    }
+    with open(args.saida, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {args.saida}")
+    if args.comparar: comparar(resultados, args.comparar)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())